@@ -0,0 +1,76 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from server_config import Server_config
+from config_registry import Config_registry
+
+# startup time of the old eager sequential load against the lazy config registry
+# run with: python benchmarks/bench_config_loading.py [guild count]
+
+GUILD_COUNT = 50_000
+
+
+def make_configs(config_dir, count):
+    for i in range(count):
+        server_id = 10**17 + i
+        messages = {
+            f'step{j}': {'content': f'Step {j} of the onboarding for <user>. ' * 5, 'buttons': [{'label': 'Next', 'target': f'step{j + 1}'}]}
+            for j in range(10)
+        }
+        with open(os.path.join(config_dir, f'{server_id}.json'), 'w') as f:
+            json.dump({
+                'messages': messages,
+                'welcome_channel_id': server_id + 1,
+                'server_id': server_id,
+                'welcome_role_id': -1,
+                'send_welcome_on_join': True,
+                'role_triggers': {str(server_id + 2): {'message_id': 'step0', 'priority': 1}},
+            }, f, indent=4)
+
+
+def eager_load():
+    # the module-level loop main.py ran before the registry existed
+    server_configs = {}
+    for filename in os.listdir('config'):
+        if filename.endswith('.json'):
+            config = Server_config()
+            config.load_config(int(filename[:-5]))
+            server_configs[config.server_id] = config
+    return server_configs
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else GUILD_COUNT
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, 'config'))
+        os.chdir(root)
+        print(f"writing {count} synthetic configs...")
+        make_configs('config', count)
+
+        start = time.perf_counter()
+        eager = eager_load()
+        eager_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        registry = Config_registry()
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        asyncio.run(registry.preload(list(registry.known)))
+        preload_time = time.perf_counter() - start
+
+        assert len(registry) == len(eager) == count
+        print(f"eager sequential load:   {eager_time:.2f}s")
+        print(f"registry index (ready):  {index_time:.2f}s")
+        print(f"registry full preload:   {preload_time:.2f}s (in the background after connecting)")
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from server_config import Server_config
+
+# per-guild memory of the old nested dict configs against the slotted Server_config records
+# run with: python benchmarks/bench_config_memory.py [guild count]
+
+GUILD_COUNT = 100_000
+
+
+def make_config_dict(i):
+    server_id = 10**17 + i
+    return {
+        'messages': {
+            f'step{j}': {
+                'content': f'Step {j} for guild {i}, hello <user>!',
+                'buttons': [{'label': 'Next', 'target': f'step{j + 1}'}, {'label': 'Back', 'target': f'step{j - 1}'}],
+            }
+            for j in range(5)
+        },
+        'welcome_channel_id': server_id + 1,
+        'server_id': server_id,
+        'welcome_role_id': -1,
+        'send_welcome_on_join': True,
+        'role_triggers': {str(server_id + k): {'message_id': 'step0', 'priority': k} for k in range(2)},
+    }
+
+
+def measure(build, count):
+    gc.collect()
+    tracemalloc.start()
+    configs = [build(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del configs
+    return size
+
+
+def build_records(i):
+    config = Server_config()
+    config.from_dict(make_config_dict(i))
+    return config
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else GUILD_COUNT
+    dict_size = measure(make_config_dict, count)
+    record_size = measure(build_records, count)
+    print(f"{count} guilds, 5 messages with 2 buttons and 2 role triggers each")
+    print(f"nested dicts:    {dict_size / count:.0f} bytes per guild ({dict_size / 2**20:.1f} MiB)")
+    print(f"slotted records: {record_size / count:.0f} bytes per guild ({record_size / 2**20:.1f} MiB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# member cache memory and gateway parse throughput for one large guild, default intents against lean mode
+# each mode runs in its own process with a discord.Client built from gateway.client_options, its ConnectionState
+# is fed synthetic GUILD_CREATE, GUILD_MEMBERS_CHUNK (answering discord.py's own chunk requests), GUILD_MEMBER_*,
+# PRESENCE_UPDATE, MESSAGE_CREATE, TYPING_START and MESSAGE_REACTION_ADD payloads. only events the client's intents
+# subscribe to are delivered, like the gateway does, and everything goes through discord.py's real parsers and cache
+# run with: python benchmarks/bench_gateway_lean.py [--members 100000]
+# needs discord.py installed, but never connects to discord
+
+# synthetic gateway traffic over one simulated minute
+EVENTS = {
+    'PRESENCE_UPDATE': 60_000,
+    'MESSAGE_CREATE': 6_000,
+    'GUILD_MEMBER_UPDATE': 1_200,
+    'GUILD_MEMBER_ADD': 300,
+    'TYPING_START': 3_000,
+    'MESSAGE_REACTION_ADD': 2_000,
+}
+# the intent discord requires before it sends each event
+EVENT_INTENTS = {
+    'PRESENCE_UPDATE': 'presences',
+    'MESSAGE_CREATE': 'guild_messages',
+    'GUILD_MEMBER_UPDATE': 'members',
+    'GUILD_MEMBER_ADD': 'members',
+    'TYPING_START': 'guild_typing',
+    'MESSAGE_REACTION_ADD': 'guild_reactions',
+}
+GUILD_ID = 10**17
+CHANNEL_ID = GUILD_ID + 1
+ROLE_COUNT = 50
+CHUNK_SIZE = 1000
+TIMESTAMP = '2024-01-01T00:00:00+00:00'
+
+
+def rss_mib():
+    # current resident set size
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def user_payload(i):
+    return {'id': str(GUILD_ID + 1000 + i), 'username': f'user{i}', 'global_name': f'User {i}', 'avatar': None, 'discriminator': '0'}
+
+
+def member_payload(rng, i):
+    return {
+        'user': user_payload(i),
+        'roles': [str(GUILD_ID + 100 + rng.randrange(ROLE_COUNT)) for _ in range(rng.randrange(5))],
+        'joined_at': TIMESTAMP,
+        'nick': None,
+        'deaf': False,
+        'mute': False,
+        'flags': 0,
+    }
+
+
+def presence_payload(rng, i):
+    return {
+        'user': {'id': str(GUILD_ID + 1000 + i)},
+        'guild_id': str(GUILD_ID),
+        'status': rng.choice(('online', 'idle', 'dnd')),
+        'activities': [{'name': f'game {rng.randrange(1000)}', 'type': 0, 'created_at': rng.getrandbits(40)}],
+        'client_status': {'desktop': 'online'},
+    }
+
+
+def guild_payload(member_count):
+    # a large guild only comes with a handful of members, the rest is chunked
+    roles = [{'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+              'hoist': False, 'managed': False, 'mentionable': False}]
+    roles += [{'id': str(GUILD_ID + 100 + i), 'name': f'role {i}', 'permissions': '0', 'position': i + 1, 'color': 0,
+               'hoist': False, 'managed': False, 'mentionable': False} for i in range(ROLE_COUNT)]
+    return {
+        'id': str(GUILD_ID),
+        'name': 'benchmark guild',
+        'member_count': member_count,
+        'large': True,
+        'roles': roles,
+        'channels': [{'id': str(CHANNEL_ID), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': []}],
+        'members': [],
+        'presences': [],
+        'emojis': [],
+        'stickers': [],
+        'features': [],
+        'threads': [],
+    }
+
+
+def event_payload(rng, name, member_count, next_member):
+    i = rng.randrange(member_count)
+    if name == 'PRESENCE_UPDATE':
+        return presence_payload(rng, i)
+    if name == 'GUILD_MEMBER_ADD':
+        return dict(member_payload(rng, next_member()), guild_id=str(GUILD_ID))
+    if name == 'GUILD_MEMBER_UPDATE':
+        return dict(member_payload(rng, i), guild_id=str(GUILD_ID))
+    if name == 'MESSAGE_CREATE':
+        return {
+            'id': str(rng.getrandbits(62)), 'channel_id': str(CHANNEL_ID), 'guild_id': str(GUILD_ID), 'type': 0,
+            'content': 'hello there', 'author': user_payload(i), 'member': {'roles': [], 'joined_at': TIMESTAMP},
+            'attachments': [], 'embeds': [], 'mentions': [], 'mention_roles': [], 'mention_everyone': False,
+            'pinned': False, 'tts': False, 'timestamp': TIMESTAMP, 'edited_timestamp': None, 'flags': 0,
+        }
+    if name == 'TYPING_START':
+        return {'channel_id': str(CHANNEL_ID), 'guild_id': str(GUILD_ID), 'user_id': str(GUILD_ID + 1000 + i),
+                'timestamp': 1704067200, 'member': member_payload(rng, i)}
+    return {'user_id': str(GUILD_ID + 1000 + i), 'channel_id': str(CHANNEL_ID), 'message_id': str(rng.getrandbits(62)),
+            'guild_id': str(GUILD_ID), 'emoji': {'id': None, 'name': '+1'}, 'burst': False, 'type': 0}
+
+
+async def run_mode(lean, member_count):
+    import discord
+    from gateway import client_options
+
+    rng = random.Random(0)
+    baseline = rss_mib()
+    client = discord.Client(**client_options(lean=lean))
+    state = client._connection
+    state.loop = asyncio.get_running_loop()
+    state.user = discord.ClientUser(state=state, data=user_payload(-1))
+    intents = state._intents
+
+    async def chunker(guild_id, query='', limit=0, presences=False, *, nonce=None, **kwargs):
+        # the request only goes out over the websocket, the chunks arrive later
+        asyncio.get_running_loop().create_task(send_chunks(guild_id, nonce))
+
+    async def send_chunks(guild_id, nonce):
+        # what discord answers to discord.py's chunk request, one GUILD_MEMBERS_CHUNK per 1000 members
+        chunk_count = (member_count + CHUNK_SIZE - 1) // CHUNK_SIZE
+        for index in range(chunk_count):
+            ids = range(index * CHUNK_SIZE, min(member_count, (index + 1) * CHUNK_SIZE))
+            chunk = {'guild_id': str(guild_id), 'nonce': nonce, 'chunk_index': index, 'chunk_count': chunk_count,
+                     'members': [member_payload(rng, i) for i in ids]}
+            if intents.presences:
+                chunk['presences'] = [presence_payload(rng, i) for i in ids]
+            state.parse_guild_members_chunk(chunk)
+            await asyncio.sleep(0)
+
+    state.chunker = chunker
+    start = time.perf_counter()
+    state.parse_guild_create(guild_payload(member_count))
+    # chunking (if the options ask for it) runs as a task, wait for it like discord.py does before guild_available
+    await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+    startup = time.perf_counter() - start
+    guild = client.get_guild(GUILD_ID)
+    after_startup = rss_mib()
+
+    added = iter(range(member_count, member_count + EVENTS['GUILD_MEMBER_ADD'] + 1))
+    stream = [name for name, count in EVENTS.items() for _ in range(count) if getattr(intents, EVENT_INTENTS[name])]
+    rng.shuffle(stream)
+    payloads = [(state.parsers[name], event_payload(rng, name, member_count, lambda: next(added))) for name in stream]
+    start = time.perf_counter()
+    for parser, payload in payloads:
+        parser(payload)
+    parsing = time.perf_counter() - start
+    del payloads
+    print(f"{'lean mode' if lean else 'default intents':<16} {len(guild.members):>7} cached members  "
+          f"rss {after_startup:6.1f} MiB ({after_startup - baseline:+6.1f} MiB for client and member cache)  "
+          f"startup {startup:5.2f}s  {len(stream) / 60:5.0f} events/sec delivered  "
+          f"parsed at {len(stream) / parsing:6.0f} events/sec  {parsing * 1000:6.0f} ms cpu per minute of traffic")
+
+def main():
+    parser = argparse.ArgumentParser(description='Member cache and gateway parsing, default intents vs. lean mode.')
+    parser.add_argument('--members', type=int, default=100_000)
+    parser.add_argument('--mode', choices=('full', 'lean'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run_mode(args.mode == 'lean', args.members))
+        return
+    print(f"guild with {args.members} members, one simulated minute of gateway traffic, each mode in a fresh process")
+    for mode in ('full', 'lean'):
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode, '--members', str(args.members)], check=True)
+
+
+if __name__ == '__main__':
+    main()
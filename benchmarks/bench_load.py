@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import Fake_client, Fake_gateway, Fake_guild, Fake_interaction, Fake_message, Fake_rest, write_configs
+import main
+from storage import Json_storage
+
+# offline load test, replays synthetic join raids, bulk role grants, command floods and button click storms
+# against the bot's handlers through the fake gateway and rest api in harness.py
+# run with: python benchmarks/bench_load.py [--guilds 50] [--events 5000]
+# needs discord.py installed, but never connects to discord
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def max_rss_mib():
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def drain_send_queue():
+    # role updates wait out their debounce window before they reach the queue
+    while main.role_debouncer.pending or main.send_queue.workers:
+        await asyncio.sleep(0.01)
+
+
+async def run_scenario(name, client, rest, events, wait_for_queue=False):
+    gateway = Fake_gateway(client)
+    requests_before = rest.requests
+    start = time.perf_counter()
+    await gateway.replay(events)
+    handled = time.perf_counter() - start
+    if wait_for_queue:
+        await drain_send_queue()
+    total = time.perf_counter() - start
+    latencies = gateway.latencies
+    print(f"{name:<16} {len(latencies):>7} events {len(latencies) / handled:>10.0f}/s  "
+          f"p50 {percentile(latencies, 50) * 1000:7.2f}ms  p99 {percentile(latencies, 99) * 1000:7.2f}ms  "
+          f"rest calls {rest.requests - requests_before:>6}  done after {total:6.2f}s  max rss {max_rss_mib():6.1f} MiB")
+
+
+async def run(args):
+    rng = random.Random(0)
+    rest = Fake_rest(latency=args.rest_latency)
+    client = Fake_client()
+    guilds = [Fake_guild(rest) for _ in range(args.guilds)]
+    for guild in guilds:
+        client.add_guild(guild)
+
+    with tempfile.TemporaryDirectory() as root:
+        write_configs(root, guilds)
+        main.create_app(bot_client=client, storage=Json_storage(root))
+        # discord's per-channel limit would make a raid take minutes of wall time, scale the queue up instead
+        main.send_queue.rate = args.queue_rate
+        main.send_queue.burst = args.queue_rate
+        main.send_queue.coalesce_window = 0.05
+        await client.setup_hook()
+        for guild in guilds:
+            await client.on_guild_available(guild)
+
+        admins = {guild.id: guild.add_member(administrator=True) for guild in guilds}
+
+        joins = [('on_member_join', (rng.choice(guilds).add_member(),)) for _ in range(args.events)]
+        await run_scenario('join raid', client, rest, joins, wait_for_queue=True)
+
+        grants = []
+        for _ in range(args.events):
+            guild = rng.choice(guilds)
+            roles = rng.sample(list(guild.roles.values()), min(10, len(guild.roles)))
+            member = guild.add_member()
+            after = guild.add_member(roles=roles)
+            after.id = member.id
+            grants.append(('on_member_update', (member, after)))
+        await run_scenario('role grants', client, rest, grants, wait_for_queue=True)
+
+        flood = []
+        for _ in range(args.events):
+            guild = rng.choice(guilds)
+            roll = rng.random()
+            if roll < 0.8:
+                # chatter that only looks like a command
+                message = Fake_message('!lol', guild.add_member(), guild.channel)
+            elif roll < 0.9:
+                message = Fake_message('!listmessages', guild.add_member(), guild.channel)
+            elif roll < 0.95:
+                # renders the message and builds a fresh view for every send
+                message = Fake_message(f'!sendmessage step{rng.randrange(1, 10)}', admins[guild.id], guild.channel)
+            else:
+                message = Fake_message(rng.choice(['!listmessages', '!listroletriggers', '!help']), admins[guild.id], guild.channel)
+            flood.append(('on_message', (message,)))
+        await run_scenario('command flood', client, rest, flood)
+
+        clicks = []
+        for _ in range(args.events):
+            guild = rng.choice(guilds)
+            interaction = Fake_interaction(guild.add_member(), guild, rest)
+            clicks.append(('on_button_click', (interaction, guild.id, f'step{rng.randrange(1, 10)}')))
+        # button clicks arrive through the view dispatcher rather than as a gateway event
+        client.on_button_click = main.on_button_click
+        await run_scenario('click storm', client, rest, clicks)
+
+        await main.config_writer.stop()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Offline load test of the bot handlers.')
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--events', type=int, default=5000, help='events per scenario')
+    parser.add_argument('--rest-latency', type=float, default=0.02, help='simulated rest api latency in seconds')
+    parser.add_argument('--queue-rate', type=float, default=200, help='send queue messages per second per channel')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,66 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from server_config import Role_trigger, Server_config
+
+# compares the old linear trigger scan in on_member_update against the compiled role trigger index
+# run with: python benchmarks/bench_role_triggers.py
+
+TRIGGER_COUNT = 5000
+ROLES_PER_GRANT = 50
+GRANTS = 2000
+
+
+def scan_triggers(role_triggers, added):
+    # the on_member_update loop before the trigger index existed, over the old json shaped triggers
+    highest_prio = -1_000_000_000
+    highest_prio_trigger = -1
+    for role in added:
+        for role_trigger in role_triggers.items():
+            role_id = int(role_trigger[0])
+            message_id = role_trigger[1]['message_id']
+            priority = role_trigger[1]['priority']
+            if role == role_id and priority > highest_prio:
+                highest_prio = priority
+                highest_prio_trigger = message_id
+    return highest_prio_trigger
+
+
+def main():
+    rng = random.Random(0)
+    server_config = Server_config()
+    role_ids = [rng.randrange(10**17, 10**18) for _ in range(TRIGGER_COUNT)]
+    role_triggers = {
+        str(role_id): {'message_id': f'msg{i}', 'priority': i} for i, role_id in enumerate(role_ids)
+    }
+    server_config.role_triggers = {int(role_id): Role_trigger.from_dict(trigger) for role_id, trigger in role_triggers.items()}
+
+    # bulk grants like a reaction-role bot, half of the roles have triggers
+    grants = []
+    for _ in range(GRANTS):
+        added = set(rng.sample(role_ids, ROLES_PER_GRANT // 2))
+        added.update(rng.randrange(10**17, 10**18) for _ in range(ROLES_PER_GRANT // 2))
+        grants.append(added)
+
+    start = time.perf_counter()
+    scanned = [scan_triggers(role_triggers, added) for added in grants[:GRANTS // 100]]
+    scan_time = (time.perf_counter() - start) * 100
+
+    start = time.perf_counter()
+    indexed = [server_config.get_triggered_role(added) for added in grants]
+    indexed = [server_config.role_triggers[role_id].message_id for role_id in indexed]
+    index_time = time.perf_counter() - start
+
+    assert scanned == indexed[:len(scanned)]
+    print(f"{TRIGGER_COUNT} triggers, {GRANTS} grants of {ROLES_PER_GRANT} roles")
+    print(f"linear scan (extrapolated): {scan_time:.3f}s")
+    print(f"trigger index:              {index_time:.3f}s")
+    print(f"speedup: {scan_time / index_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
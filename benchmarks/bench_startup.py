@@ -0,0 +1,87 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# cold start time of the bot, with and without the config snapshot
+# each run is a fresh python process that imports the bot, builds it and makes every guild available
+# (as the GUILD_CREATE burst after connecting does), it is ready once every config is loaded and its views compiled
+# run with: python benchmarks/bench_startup.py [--guilds 2000] [--runs 5]
+# needs discord.py installed, but never connects to discord
+
+
+def start_bot(config_dir, save_snapshot):
+    # runs in the child process, prints the seconds until the bot was ready
+    start = time.perf_counter()
+    import asyncio
+    # harness puts the repository on sys.path
+    from harness import Fake_client, Fake_guild, Fake_rest
+    import main
+    from storage import Json_storage
+
+    async def start_up():
+        storage = Json_storage(config_dir)
+        rest = Fake_rest(latency=0)
+        client = Fake_client()
+        guilds = []
+        for guild_id in storage.list_guild_ids():
+            guild = Fake_guild(rest)
+            guild.id = guild_id
+            client.add_guild(guild)
+            guilds.append(guild)
+        main.create_app(bot_client=client, storage=storage)
+        await client.setup_hook()
+        await asyncio.gather(*(client.on_guild_available(guild) for guild in guilds))
+        ready = time.perf_counter() - start
+        await main.config_writer.stop()
+        if save_snapshot:
+            main.save_config_snapshot()
+        return ready
+
+    print(asyncio.run(start_up()))
+
+
+def run_child(config_dir, save_snapshot=False):
+    command = [sys.executable, os.path.abspath(__file__), '--child', config_dir]
+    if save_snapshot:
+        command.append('--save-snapshot')
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Cold start time with and without the config snapshot.')
+    parser.add_argument('--guilds', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', metavar='CONFIG_DIR', help=argparse.SUPPRESS)
+    parser.add_argument('--save-snapshot', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.child:
+        start_bot(args.child, args.save_snapshot)
+        return
+
+    from harness import Fake_guild, Fake_rest, write_configs
+    from config_snapshot import SNAPSHOT_FILE
+
+    with tempfile.TemporaryDirectory() as root:
+        rest = Fake_rest(latency=0)
+        write_configs(root, [Fake_guild(rest) for _ in range(args.guilds)])
+        snapshot_path = os.path.join(root, SNAPSHOT_FILE)
+
+        json_times = [run_child(root) for _ in range(args.runs)]
+        # one more start that shuts down cleanly and leaves the snapshot behind
+        run_child(root, save_snapshot=True)
+        snapshot_size = os.path.getsize(snapshot_path)
+        snapshot_times = [run_child(root) for _ in range(args.runs)]
+
+        print(f"{args.guilds} guilds, median of {args.runs} cold starts, snapshot is {snapshot_size / 1024 / 1024:.1f} MiB")
+        print(f"json only        {statistics.median(json_times) * 1000:8.1f} ms to ready")
+        print(f"with snapshot    {statistics.median(snapshot_times) * 1000:8.1f} ms to ready")
+
+
+if __name__ == '__main__':
+    main_cli()
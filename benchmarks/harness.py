@@ -0,0 +1,205 @@
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+import discord
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# local stand-ins for the discord gateway and rest api, so the bot's handlers can be driven offline
+# the fakes only implement the attributes and coroutines main.py actually uses
+
+snowflakes = itertools.count(10**17)
+
+
+def next_id():
+    return next(snowflakes)
+
+
+class Fake_rest:
+    # records every request the bot makes, each one takes latency seconds to "reach discord"
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.requests = 0
+        self.messages = 0
+
+    async def request(self, route, content=None):
+        self.requests += 1
+        if route == 'messages':
+            self.messages += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class Fake_permissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class Fake_role:
+    def __init__(self, role_id, name=None, administrator=False):
+        self.id = role_id
+        self.name = name or f'role {role_id}'
+        self.permissions = Fake_permissions(administrator)
+
+
+class Fake_member:
+    def __init__(self, guild, roles=(), administrator=False, bot=False):
+        self.id = next_id()
+        self.guild = guild
+        self.roles = list(roles)
+        self.bot = bot
+        self.guild_permissions = Fake_permissions(administrator)
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+
+class Fake_channel:
+    def __init__(self, guild, rest):
+        self.id = next_id()
+        self.guild = guild
+        self.name = f'channel {self.id}'
+        self.rest = rest
+
+    async def send(self, content=None, view=None, **kwargs):
+        await self.rest.request('messages', content)
+
+
+class Fake_guild:
+    def __init__(self, rest, member_count=1000):
+        self.id = next_id()
+        self.name = f'guild {self.id}'
+        self.member_count = member_count
+        self.members = {}
+        self.roles = {}
+        self.channel = Fake_channel(self, rest)
+        # every member the fakes hand out is cached already
+        self.chunked = True
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def add_member(self, **kwargs):
+        member = Fake_member(self, **kwargs)
+        self.members[member.id] = member
+        return member
+
+
+class Fake_message:
+    def __init__(self, content, author, channel):
+        self.id = next_id()
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+
+
+class Fake_response:
+    def __init__(self, rest):
+        self.rest = rest
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, view=None, ephemeral=False, **kwargs):
+        self.done = True
+        await self.rest.request('interaction_response', content)
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self.done = True
+        await self.rest.request('interaction_response')
+
+
+class Fake_followup:
+    def __init__(self, rest):
+        self.rest = rest
+
+    async def send(self, content=None, view=None, ephemeral=False, **kwargs):
+        await self.rest.request('messages', content)
+
+
+class Fake_interaction:
+    def __init__(self, user, guild, rest):
+        self.id = next_id()
+        self.user = user
+        self.guild = guild
+        self.created_at = discord.utils.utcnow()
+        self.response = Fake_response(rest)
+        self.followup = Fake_followup(rest)
+
+
+class Fake_client:
+    # the bits of discord.Client main.py uses, event handlers are set as attributes like client.event does
+    def __init__(self):
+        self.user = Fake_member(None, bot=True)
+        self.user.name = 'load test bot'
+        self.guilds = {}
+        self.channels = {}
+        self.dynamic_items = []
+
+    def event(self, coro):
+        setattr(self, coro.__name__, coro)
+        return coro
+
+    def add_guild(self, guild):
+        self.guilds[guild.id] = guild
+        self.channels[guild.channel.id] = guild.channel
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def add_dynamic_items(self, *items):
+        self.dynamic_items.extend(items)
+
+
+class Fake_gateway:
+    # dispatches events to the client's handlers the way discord.py does, one task per event,
+    # and records how long each handler took
+    def __init__(self, client):
+        self.client = client
+        self.latencies = []
+
+    async def run_handler(self, handler, args):
+        start = time.perf_counter()
+        await handler(*args)
+        self.latencies.append(time.perf_counter() - start)
+
+    async def replay(self, events):
+        # events is an iterable of (handler name, args), all of them are in flight at once like during a raid
+        tasks = [asyncio.ensure_future(self.run_handler(getattr(self.client, name), args)) for name, args in events]
+        await asyncio.gather(*tasks)
+
+
+def write_configs(config_dir, guilds, messages_per_guild=10, triggers_per_guild=20):
+    # one config per fake guild, a chain of messages starting at welcome and a few role triggers
+    for guild in guilds:
+        message_ids = ['welcome'] + [f'step{i}' for i in range(1, messages_per_guild)]
+        messages = {}
+        for i, message_id in enumerate(message_ids):
+            buttons = [{'label': 'Next', 'target': message_ids[i + 1]}] if i + 1 < len(message_ids) else []
+            messages[message_id] = {'content': f'Hello <user>, welcome to <server>! This is {message_id}.', 'buttons': buttons}
+        role_triggers = {}
+        for priority in range(triggers_per_guild):
+            role = Fake_role(next_id())
+            guild.roles[role.id] = role
+            role_triggers[str(role.id)] = {'message_id': message_ids[priority % len(message_ids)], 'priority': priority}
+        with open(os.path.join(config_dir, f'{guild.id}.json'), 'w') as f:
+            json.dump({
+                'messages': messages,
+                'welcome_channel_id': guild.channel.id,
+                'server_id': guild.id,
+                'welcome_role_id': -1,
+                'send_welcome_on_join': True,
+                'role_triggers': role_triggers,
+            }, f)
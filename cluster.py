@@ -0,0 +1,78 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import constants
+
+# runs the bot as several worker processes, each one an AutoShardedClient that owns a contiguous range of shards
+# all workers share the config storage (use the sqlite backend for a cluster), and since a guild always lives
+# on exactly one shard, only its owning worker ever caches or writes its config
+# usage: python cluster.py --shards 16 --workers 4
+
+RESTART_DELAY = 5.0
+
+
+def shard_ranges(shard_count, worker_count):
+    # splits the shards into worker_count contiguous ranges of (almost) equal size
+    ranges = []
+    start = 0
+    for worker in range(worker_count):
+        size = shard_count // worker_count + (1 if worker < shard_count % worker_count else 0)
+        ranges.append(range(start, start + size))
+        start += size
+    return [shards for shards in ranges if shards]
+
+
+def start_worker(shard_count, shards):
+    env = dict(os.environ)
+    env[constants.SHARD_COUNT_VARIABLE] = str(shard_count)
+    env[constants.SHARD_IDS_VARIABLE] = f'{shards.start}-{shards.stop - 1}'
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    return subprocess.Popen([sys.executable, main_path], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot as a cluster of sharded worker processes.')
+    parser.add_argument('--shards', type=int, required=True, help='total number of shards')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    args = parser.parse_args()
+
+    if not os.environ.get(constants.SQLITE_PATH_VARIABLE):
+        print(f"warning: {constants.SQLITE_PATH_VARIABLE} is not set, workers will share the json config directory")
+
+    ranges = shard_ranges(args.shards, min(args.workers, args.shards))
+    workers = {}
+    for shards in ranges:
+        workers[shards] = start_worker(args.shards, shards)
+        print(f"started worker {workers[shards].pid} for shards {shards.start}-{shards.stop - 1}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers.values():
+            process.send_signal(signal.SIGINT)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # restart workers that die until we are told to stop
+    while workers:
+        time.sleep(1)
+        for shards, process in list(workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if stopping:
+                del workers[shards]
+                continue
+            print(f"worker for shards {shards.start}-{shards.stop - 1} exited with {code}, restarting in {RESTART_DELAY}s")
+            time.sleep(RESTART_DELAY)
+            workers[shards] = start_worker(args.shards, shards)
+
+
+if __name__ == '__main__':
+    main()
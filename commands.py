@@ -0,0 +1,123 @@
+from functools import lru_cache
+from templates import MAX_MESSAGE_LENGTH
+
+# table-driven admin commands
+# every command declares how its arguments are parsed, a message is dispatched with a single dict lookup
+# on its first word, and unknown commands are dropped before any permission check
+
+PARSE_CACHE_SIZE = 1024
+# leaves room for a page footer
+PAGE_LENGTH = MAX_MESSAGE_LENGTH - 100
+
+
+def parse_int(text):
+    return int(text)
+
+
+def parse_float(text):
+    return float(text)
+
+
+def parse_role(text):
+    # accepts a role mention or a plain role id
+    return int(text.replace("<@&", "").replace(">", ""))
+
+
+def parse_channel(text):
+    # accepts a channel mention or a plain channel id
+    return int(text.replace("<#", "").replace(">", ""))
+
+
+def parse_bool(text):
+    value = text.lower()
+    if value not in ("true", "false"):
+        raise ValueError(text)
+    return value == "true"
+
+
+def parse_str(text):
+    return text
+
+
+def paginate(lines, limit=PAGE_LENGTH):
+    # packs lines into pages that each fit into one discord message
+    pages = []
+    page = []
+    length = 0
+    for line in lines:
+        line = line[:limit]
+        if page and length + len(line) + 1 > limit:
+            pages.append("\n".join(page))
+            page = []
+            length = 0
+        page.append(line)
+        length += len(line) + 1
+    if page:
+        pages.append("\n".join(page))
+    return pages
+
+
+class Command:
+    def __init__(self, name, handler, args, usage, description, rest=False, needs_config=True,
+                 missing_message=None, invalid_message=None, optional=0):
+        self.name = name
+        # handler(message, server_config, *args), server_config is None for commands that don't need one
+        self.handler = handler
+        # one parser per argument, with rest=True the last argument gets all remaining words
+        self.args = args
+        self.usage = usage
+        self.description = description
+        self.rest = rest
+        # how many of the last arguments may be left out, the handler's defaults are used for them
+        self.optional = optional
+        self.needs_config = needs_config
+        self.missing_message = missing_message or f"Usage: {usage}"
+        self.invalid_message = invalid_message or f"Usage: {usage}"
+
+    def parse(self, words):
+        # returns (args, None) or (None, error message)
+        if len(words) < len(self.args) - self.optional:
+            return None, self.missing_message
+        if self.rest and self.args:
+            words = words[:len(self.args) - 1] + [" ".join(words[len(self.args) - 1:])]
+        try:
+            return tuple(parser(word) for parser, word in zip(self.args, words)), None
+        except ValueError:
+            return None, self.invalid_message
+
+
+class Command_registry:
+    def __init__(self):
+        self.commands = {}
+        self.parse = lru_cache(maxsize=PARSE_CACHE_SIZE)(self.parse_uncached)
+
+    def command(self, name, args=(), usage=None, description="", **kwargs):
+        # decorator that registers a handler under name
+        def register(handler):
+            self.commands[name] = Command(name, handler, list(args), usage or name, description, **kwargs)
+            self.parse.cache_clear()
+            return handler
+        return register
+
+    def get(self, content):
+        # the command a message is addressed to, or None if it isn't one of ours
+        return self.commands.get(content.split(" ", 1)[0])
+
+    def parse_uncached(self, content):
+        # returns (command, args, error), cached because busy channels repeat the same messages a lot
+        words = content.split(" ")
+        command = self.commands.get(words[0])
+        if command is None:
+            return None, None, None
+        args, error = command.parse(words[1:])
+        return command, args, error
+
+    def help_lines(self):
+        return [f"{command.usage} - {command.description}" for command in self.commands.values()]
+
+
+def is_admin(guild, user):
+    # not cached, a cached answer goes stale on kicks and rejoins, role deletes, ownership transfers and member
+    # updates lean mode never sees. a message author in a guild already is a member carrying its roles, so this is cheap
+    member = user if hasattr(user, 'guild_permissions') else guild.get_member(user.id)
+    return bool(member and member.guild_permissions.administrator)
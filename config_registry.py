@@ -0,0 +1,143 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from server_config import Server_config
+from config_snapshot import read_snapshot, write_snapshot
+
+# lazily loaded server configs
+# at startup only the guild ids in storage are indexed, a guild's config is parsed the first time it is accessed
+# (or preloaded in a thread pool when its GUILD_CREATE arrives) and guilds that haven't been touched
+# in a while are evicted again
+
+DEFAULT_MAX_LOADED = 10_000
+PRELOAD_WORKERS = 8
+
+
+class Config_registry:
+    def __init__(self, storage=None, max_loaded=DEFAULT_MAX_LOADED, writer=None, owns=None, on_evict=None):
+        self.storage = storage if storage is not None else Server_config.storage
+        # owns(guild_id) -> bool, when running as one worker of a cluster only the guilds on our shards are indexed,
+        # so every guild is cached and written by exactly one worker and config changes never go stale across workers
+        self.owns = owns
+        self.max_loaded = max_loaded
+        # guilds with unsaved edits are never evicted, otherwise a reload would read the stale file
+        self.writer = writer
+        # on_evict(guild_id) is called whenever a loaded config leaves memory, so caches built from it can let go too
+        self.on_evict = on_evict
+        self.loaded = OrderedDict()
+        self.known = set()
+        self.executor = None
+        self.index()
+
+    def index(self):
+        guild_ids = self.storage.list_guild_ids()
+        if self.owns is not None:
+            guild_ids = [guild_id for guild_id in guild_ids if self.owns(guild_id)]
+        self.known = set(guild_ids)
+
+    def load(self, guild_id):
+        config = Server_config()
+        config.load_config(guild_id)
+        return config
+
+    def get(self, guild_id, default=None):
+        config = self.loaded.get(guild_id)
+        if config is not None:
+            self.loaded.move_to_end(guild_id)
+            return config
+        if guild_id not in self.known:
+            return default
+        try:
+            config = self.load(guild_id)
+        except (OSError, ValueError) as e:
+            print(f"failed to load config for guild {guild_id}: {e}")
+            return default
+        self[guild_id] = config
+        return config
+
+    def __setitem__(self, guild_id, config):
+        self.known.add(guild_id)
+        previous = self.loaded.get(guild_id)
+        if previous is not None and previous is not config:
+            self.evicted(guild_id)
+        self.loaded[guild_id] = config
+        self.loaded.move_to_end(guild_id)
+        self.evict()
+
+    def load_snapshot(self, path):
+        # takes over the configs from a snapshot whose json file is unchanged, the rest are parsed from json as usual
+        entries = read_snapshot(path)
+        if not entries:
+            return 0
+        versions = self.storage.scan()
+        used = 0
+        for guild_id, (version, config) in entries.items():
+            if guild_id in self.known and guild_id not in self.loaded and versions.get(guild_id) == version:
+                self.storage.versions[guild_id] = version
+                self.loaded[guild_id] = config
+                used += 1
+        self.evict()
+        return used
+
+    def save_snapshot(self, path):
+        # every loaded config that matches its file on disk, so call it after the writer was flushed
+        versions = self.storage.versions
+        entries = {
+            guild_id: (versions[guild_id], config) for guild_id, config in self.loaded.items()
+            if guild_id in versions and (self.writer is None or guild_id not in self.writer.dirty)
+        }
+        write_snapshot(path, entries)
+        return len(entries)
+
+    def forget(self, guild_id):
+        # the guild's config was deleted from storage
+        self.known.discard(guild_id)
+        if self.loaded.pop(guild_id, None) is not None:
+            self.evicted(guild_id)
+
+    def __contains__(self, guild_id):
+        return guild_id in self.known
+
+    def __len__(self):
+        return len(self.known)
+
+    def values(self):
+        # only the configs that are currently loaded
+        return list(self.loaded.values())
+
+    def evict(self):
+        if len(self.loaded) <= self.max_loaded:
+            return
+        for guild_id in list(self.loaded):
+            if len(self.loaded) <= self.max_loaded:
+                break
+            if self.writer is not None and guild_id in self.writer.dirty:
+                continue
+            del self.loaded[guild_id]
+            self.evicted(guild_id)
+
+    def evicted(self, guild_id):
+        if self.on_evict is not None:
+            self.on_evict(guild_id)
+
+    async def preload(self, guild_ids):
+        # parse several guild configs concurrently off the event loop, returns the loaded configs
+        guild_ids = [guild_id for guild_id in guild_ids if guild_id in self.known and guild_id not in self.loaded]
+        if not guild_ids:
+            return []
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=PRELOAD_WORKERS, thread_name_prefix='config-preload')
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, self.load, guild_id) for guild_id in guild_ids),
+            return_exceptions=True,
+        )
+        configs = []
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                print(f"failed to load config for guild {guild_id}: {result}")
+            elif guild_id not in self.loaded:
+                # an access on the loop thread may have loaded it in the meantime
+                self[guild_id] = result
+                configs.append(result)
+        return configs
@@ -0,0 +1,73 @@
+import gc
+import hashlib
+import os
+import pickle
+
+# binary snapshot of the loaded server configs, written on shutdown and read in one go at startup,
+# so a restart doesn't have to parse every guild's json file again.
+# configs are stored as pickled Server_config objects, compiled templates included, each together
+# with the version (mtime and size) of the json file it matches, and only used if that file hasn't changed since.
+# the file is only ever written by the bot itself, the checksum catches truncated or corrupted snapshots
+
+SNAPSHOT_FILE = 'configs.snapshot'
+SNAPSHOT_MAGIC = b'CBMSNAP'
+# bump whenever Server_config or the records it holds change shape, older snapshots are then ignored
+SNAPSHOT_VERSION = 3
+HEADER_LENGTH = len(SNAPSHOT_MAGIC) + 1 + hashlib.sha256().digest_size
+
+
+def snapshot_file(shard_count=None, shard_ids=None):
+    # every worker of a cluster only holds the guilds on its own shards, so each one gets its own snapshot
+    if shard_count is None or shard_ids is None:
+        return SNAPSHOT_FILE
+    shards = '_'.join(f'{first}-{last}' for first, last in shard_ranges(sorted(shard_ids)))
+    return f'configs.{shard_count}.{shards}.snapshot'
+
+
+def shard_ranges(shard_ids):
+    # [0, 1, 2, 5] -> [(0, 2), (5, 5)]
+    ranges = []
+    for shard_id in shard_ids:
+        if ranges and ranges[-1][1] == shard_id - 1:
+            ranges[-1] = (ranges[-1][0], shard_id)
+        else:
+            ranges.append((shard_id, shard_id))
+    return ranges
+
+
+def write_snapshot(path, entries):
+    # entries is {guild_id: (json file version, Server_config)}
+    payload = pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]) + hashlib.sha256(payload).digest())
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    # returns {guild_id: (json file version, Server_config)}, or None if there is no usable snapshot
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER_LENGTH or not data.startswith(SNAPSHOT_MAGIC) or data[len(SNAPSHOT_MAGIC)] != SNAPSHOT_VERSION:
+        return None
+    payload = memoryview(data)[HEADER_LENGTH:]
+    if hashlib.sha256(payload).digest() != data[len(SNAPSHOT_MAGIC) + 1:HEADER_LENGTH]:
+        print(f"ignoring config snapshot {path}, checksum mismatch")
+        return None
+    # unpickling creates a few hundred thousand objects, without pausing the gc it spends most of the time collecting
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(payload)
+    except (pickle.UnpicklingError, AttributeError, EOFError, ImportError, TypeError, ValueError) as e:
+        print(f"ignoring config snapshot {path}: {e}")
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
@@ -0,0 +1,98 @@
+import asyncio
+from config_registry import Config_registry
+
+# hot reload of config/*.json files changed outside the bot
+# changes are picked up with inotify (through watchfiles, if it is installed) or by polling file mtimes,
+# only the affected guild is reparsed and only the messages and role triggers that actually changed are invalidated
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class Config_watcher:
+    def __init__(self, registry: Config_registry, poll_interval=DEFAULT_POLL_INTERVAL):
+        # only works with Json_storage, the sqlite backend has no files to watch
+        self.registry = registry
+        self.storage = registry.storage
+        self.poll_interval = poll_interval
+        self.files = {}
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        self.files = await asyncio.to_thread(self.storage.scan)
+        try:
+            import watchfiles
+        except ImportError:
+            watchfiles = None
+        if watchfiles is not None:
+            async for _ in watchfiles.awatch(self.storage.config_dir):
+                await self.check()
+        else:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                await self.check()
+
+    async def check(self):
+        files = await asyncio.to_thread(self.storage.scan)
+        changed = [guild_id for guild_id, stat in files.items() if self.files.get(guild_id) != stat]
+        removed = [guild_id for guild_id in self.files if guild_id not in files]
+        self.files = files
+        for guild_id in removed:
+            self.storage.versions.pop(guild_id, None)
+            # also drops the guild's compiled responses
+            self.registry.forget(guild_id)
+            print(f"config for guild {guild_id} was removed")
+        for guild_id in changed:
+            # skip the files our own writer just saved, or that were loaded after they changed
+            if self.storage.versions.get(guild_id) == files[guild_id]:
+                continue
+            await self.reload(guild_id)
+
+    def load(self, guild_id):
+        # runs in the executor, returns the config with the file version it was read from
+        config = self.registry.load(guild_id)
+        return config, self.storage.versions.get(guild_id)
+
+    def has_unsaved_edits(self, guild_id):
+        writer = self.registry.writer
+        if writer is not None and guild_id in writer.dirty:
+            print(f"config for guild {guild_id} changed on disk but has unsaved edits, keeping the in-memory version")
+            return True
+        return False
+
+    async def reload(self, guild_id):
+        registry = self.registry
+        if registry.owns is not None and not registry.owns(guild_id):
+            return
+        if guild_id not in registry.loaded:
+            # not in memory, it will be read fresh on first access
+            registry.known.add(guild_id)
+            return
+        if self.has_unsaved_edits(guild_id):
+            return
+        try:
+            new_config, version = await asyncio.get_running_loop().run_in_executor(None, self.load, guild_id)
+        except (OSError, ValueError) as e:
+            print(f"failed to reload config for guild {guild_id}: {e}")
+            return
+        config = registry.loaded.get(guild_id)
+        if config is None:
+            return
+        # an admin may have edited the guild while the file was read, or our writer saved it in the meantime,
+        # either way the freshly loaded version is already stale and applying it would undo that edit
+        if self.has_unsaved_edits(guild_id) or self.storage.versions.get(guild_id) != version:
+            return
+        changed_messages, changed_triggers = config.apply_reload(new_config)
+        print(f"reloaded config for guild {guild_id}: {len(changed_messages)} messages and {len(changed_triggers)} role triggers changed")
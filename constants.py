@@ -1 +1,9 @@
-BOT_TOKEN_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_TOKEN"
\ No newline at end of file
+BOT_TOKEN_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_TOKEN"
+SQLITE_PATH_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_SQLITE_PATH"
+LEAN_MODE_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_LEAN_MODE"
+DISABLE_COMMANDS_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_DISABLE_COMMANDS"
+SHARDED_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_SHARDED"
+SHARD_COUNT_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_SHARD_COUNT"
+SHARD_IDS_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_SHARD_IDS"
+METRICS_PORT_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_METRICS_PORT"
+WATCH_CONFIG_VARIABLE = "CUSTOM_MESSAGE_DISCORD_BOT_WATCH_CONFIG"
@@ -0,0 +1,73 @@
+import discord
+
+# gateway intents and member caching
+# the default mode keeps the original setup, lean mode only asks discord for what the handlers actually read
+# with sharding enabled one process runs an AutoShardedClient for a range of shards, see cluster.py
+
+
+def full_client_options():
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.guilds = True
+    intents.messages = True
+    intents.message_content = True
+    intents.presences = True
+    return {'intents': intents}
+
+
+def lean_client_options(commands_enabled=True):
+    intents = discord.Intents.none()
+    # guild availability, channels and roles
+    intents.guilds = True
+    # on_member_join and on_member_update
+    intents.members = True
+    if commands_enabled:
+        # admin commands are the only reason to read messages, and only in guilds
+        # (message content is a global privileged intent, discord has no way to scope it to some channels)
+        intents.guild_messages = True
+        intents.message_content = True
+    return {
+        'intents': intents,
+        # keep members that joined while we're online and the ones of chunked guilds
+        'member_cache_flags': discord.MemberCacheFlags(voice=False, joined=True),
+        # don't request every member of every guild at startup, discord.py drops member updates of uncached members
+        # though, so main.on_guild_available chunks the guilds that have role triggers
+        'chunk_guilds_at_startup': False,
+    }
+
+
+def client_options(lean=False, commands_enabled=True):
+    if lean:
+        return lean_client_options(commands_enabled)
+    return full_client_options()
+
+
+def shard_for_guild(guild_id, shard_count):
+    # the shard discord routes a guild's events to
+    return (guild_id >> 22) % shard_count
+
+
+def parse_shard_ids(text):
+    # "0,1,2" or a range like "0-7"
+    shard_ids = []
+    for part in text.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
+
+
+def create_client(lean=False, commands_enabled=True, shard_count=None, shard_ids=None, sharded=False):
+    # a plain Client unless sharding is requested, then an AutoShardedClient for the given shards
+    # (or for every shard discord recommends when no shard count is given)
+    options = client_options(lean, commands_enabled)
+    if not sharded and shard_count is None:
+        return discord.Client(**options)
+    if shard_count is not None:
+        options['shard_count'] = shard_count
+    if shard_ids is not None:
+        options['shard_ids'] = shard_ids
+    return discord.AutoShardedClient(**options)
@@ -1,35 +1,81 @@
+import asyncio
+import io
+import json
+import logging
 import os
+import signal
+import time
 from typing import Optional
 import discord
 import constants
-from server_config import Server_config
+from server_config import Server_config, parse_config
+from persistence import Config_writer
+from views import View_cache
+from send_queue import Send_queue
+from config_registry import Config_registry
+from storage import Json_storage, Sqlite_storage
+from config_snapshot import snapshot_file
+from sessions import ALLOWED, DUPLICATE, Session_store
+from role_debounce import MAX_ROLE_DEBOUNCE, Role_debouncer
+from gateway import create_client, parse_shard_ids, shard_for_guild
+from metrics import Rate_limit_log_handler, bot_metrics, start_metrics_server
+from commands import Command_registry, is_admin, paginate, parse_bool, parse_channel, parse_float, parse_int, parse_role, parse_str
 
 # have a json file that acts as a config for the bot
 # it should contain a list of messages and their message ID strings (which are human readable)
 # each message should also have a list of customizable buttons that can link to another message
 # all of this should be able to be edited by an admin user through discord commands
 
-os.makedirs('config', exist_ok=True)
+# the app is built by create_app instead of at import time, so the handlers can be imported and driven
+# without connecting to discord (see benchmarks/harness.py)
+client = None
+config_writer = None
+server_configs = None
+view_cache = None
+send_queue = None
+config_watcher = None
+sessions = None
+role_debouncer = None
+config_snapshot_path = None
+
+# attachments larger than this are refused by !importconfig
+MAX_IMPORT_SIZE = 8 * 1024 * 1024
+# at most this many validation errors are listed when an import is refused
+MAX_LISTED_ERRORS = 20
+
+
+async def setup_hook():
+    # client.run only turns SIGINT into a clean shutdown, systemd, docker stop and kubernetes send SIGTERM.
+    # closing the client on it too lets run() flush pending edits and write the config snapshot either way
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(client.close()))
+    except NotImplementedError:
+        # no signal handlers on the windows event loop
+        pass
+    config_writer.start()
+    if config_watcher is not None:
+        config_watcher.start()
+    if os.environ.get(constants.METRICS_PORT_VARIABLE):
+        await start_metrics_server(int(os.environ[constants.METRICS_PORT_VARIABLE]))
+
+
+async def on_guild_available(guild: discord.Guild):
+    # GUILD_CREATE events stream in at startup, parse their configs in the background as they arrive
+    await server_configs.preload([guild.id])
+    server_config = server_configs.get(guild.id)
+    if server_config:
+        view_cache.register_guild(server_config)
+        await cache_members_for_role_triggers(guild, server_config)
+
+
+async def cache_members_for_role_triggers(guild: discord.Guild, server_config: Server_config):
+    # discord.py drops member updates for members it hasn't cached, lean mode doesn't chunk at startup, so without
+    # this a role trigger would never fire for a member who was already there when the bot started.
+    # only guilds that have role triggers are chunked, the default mode has chunked every guild already
+    if server_config.role_triggers and not guild.chunked:
+        await guild.chunk()
 
-intents = discord.Intents.default()
-intents.members = True
-intents.guilds = True
-intents.messages = True
-intents.message_content = True
-intents.presences = True
 
-client = discord.Client(intents=intents)
-server_configs = {}
-
-# load all the server configs in config folder
-for filename in os.listdir('config'):
-    if filename.endswith('.json'):
-        config = Server_config()
-        config.load_config(int(filename[:-5]))
-        server_configs[config.server_id] = config
-
-
-@client.event
 async def on_ready():
     print(f'{client.user.name} has connected to Discord!')
 
@@ -37,16 +83,18 @@ async def on_ready():
 async def send_welcome_message(member: discord.Member, server_config: Server_config):
     channel = client.get_channel(server_config.welcome_channel_id)
     if channel and server_config.get_message('welcome'):
-        await send_button_message(channel, 'welcome', member.guild.id, member)
+        # queued so a join raid gets merged into a few messages instead of hitting the rate limit
+        send_queue.enqueue(channel, member.guild.id, 'welcome', member)
 
 
-@client.event
+@bot_metrics.timed('event', handler='on_member_join')
 async def on_member_join(member):
     if member.bot:
         return
 
     server_config = server_configs.get(member.guild.id)
     if not server_config:
+        bot_metrics.inc('config_missing_total', handler='on_member_join')
         print("no server config found for this guild id " + str(member.guild.id))
         return
 
@@ -56,13 +104,14 @@ async def on_member_join(member):
     await send_welcome_message(member, server_config)
 
 
-@client.event
+@bot_metrics.timed('event', handler='on_member_update')
 async def on_member_update(before: discord.Member, after: discord.Member):
     if after.bot:
         return
 
     server_config = server_configs.get(after.guild.id)
     if not server_config:
+        bot_metrics.inc('config_missing_total', handler='on_member_update')
         print("no server config found for this guild id " + str(after.guild.id))
         return
     
@@ -74,287 +123,409 @@ async def on_member_update(before: discord.Member, after: discord.Member):
     if not added:
         return
 
-    highest_prio = -1_000_000_000
-    highest_prio_trigger = -1
-    for role in added:
-        for role_trigger in server_config.role_triggers.items():
-            role_id = int(role_trigger[0])
-            message_id = role_trigger[1]['message_id']
-            priority = role_trigger[1]['priority']
-            if role == role_id and priority > highest_prio:
-                highest_prio = priority
-                highest_prio_trigger = message_id
-    
-    if highest_prio_trigger != -1:
-        await send_button_message(
-            target=client.get_channel(server_config.welcome_channel_id),
-            message_id=highest_prio_trigger,
-            guild_id=after.guild.id,
-            addressed_user=after
-        )
+    # roles granted one at a time are collected for a moment, so the highest priority trigger wins across all of them
+    if server_config.role_debounce_seconds > 0:
+        role_debouncer.add(after, added, server_config.role_debounce_seconds)
+    else:
+        send_role_trigger_message(after, added)
 
 
-@client.event
+def send_role_trigger_message(member: discord.Member, added_role_ids: set):
+    server_config = server_configs.get(member.guild.id)
+    if not server_config:
+        return
+    triggered_role_id = server_config.get_triggered_role(added_role_ids)
+    channel = client.get_channel(server_config.welcome_channel_id)
+    if triggered_role_id is not None and channel:
+        message_id = server_config.role_triggers[triggered_role_id].message_id
+        send_queue.enqueue(channel, member.guild.id, message_id, member, triggered_role_id)
+
+
+@bot_metrics.timed('event', handler='on_message')
 async def on_message(message):
     if message.author == client.user:
         return
-    
-        # try to process command if user is admin
-    if len(message.content) > 0 and message.content[0] == '!':
-        is_admin = False
-        if message.guild:
-            member = message.guild.get_member(message.author.id)
-            if member and member.guild_permissions.administrator:
-                is_admin = True
-        if is_admin:
-            await process_command(message)
+
+    # unknown commands are dropped here, before the permission check
+    if not message.content.startswith('!') or not message.guild:
+        return
+    if commands.get(message.content) is None:
+        return
+
+    # try to process command if user is admin
+    if is_admin(message.guild, message.author):
+        await process_command(message)
 
 
 async def process_command(message: discord.Message):
-    command = message.content.split(" ")
-    if command[0] == "!help":
-        help_message = (
-            "Available commands:\n"
-            "!init - Initialize server config (only if not already initialized).\n"
-            "!setwelcomechannel <channel_id> - Set the welcome channel by ID.\n"
-            "!setwelcomerole <role_id> - Set the welcome role by ID. Welcome message will be sent in reaction to role addition.\n"
-            "!setmessage <message_id> <message> - Set a message by ID (ID \"welcome\" is the welcome message that gets sent into the specified welcome channel). Use \"<user>\" in the message text to mention the user.\n"
-            "!listmessages - List all configured messages.\n"
-            "!setbutton <message_id> <target_message_id> <button_label> - Add a button to a message.\n"
-            "!sendmessage <message_id> - Send a configured message to the current channel for debugging.\n"
-            "!deletemessage <message_id> - Delete a configured message by ID.\n"
-            "!deletebutton <message_id> <button_label> - Delete a button from a message by its label.\n"
-            "!welcomeonjoinenabled <true|false> - Enable or disable welcome messages on member join.\n"
-            "!addroletrigger <role_id> <message_id> <priority (int)> - Send a message when a user is given a specific role, if multiple roles get added at once the highest prio one gets sent.\n"
-            "!deleteroletrigger <role_id> - Delete a role trigger.\n"
-            "!listroletriggers - List all role triggers for this server.\n"
-        )
-        await message.channel.send(help_message)
-    elif command[0] == "!init":
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            await message.channel.send("Server config already initialized.")
-        else:
-            config = Server_config()
-            config.server_id = message.guild.id
-            config.welcome_channel_id = -1
-            config.welcome_role_id = -1
-            config.send_welcome_on_join = True
-            config.messages = {}
-            config.save_config()
-            server_configs[message.guild.id] = config
-            await message.channel.send("Server config initialized, please use `!setmessage welcome <message>` to set the welcome message and `!setwelcomechannel <channel_id>` to set the welcome channel.")
-    elif command[0] == "!setwelcomechannel":
-        if len(command) < 2:
-            await message.channel.send("Please provide a channel ID.")
-            return
-        try:
-            channel_id = int(command[1].replace("<#", "").replace(">", ""))
-            channel = client.get_channel(channel_id)
-            if channel and channel.guild.id == message.guild.id:
-                server_config = server_configs.get(message.guild.id)
-                if server_config:
-                    server_config.welcome_channel_id = channel_id
-                    server_config.save_config()
-                    await message.channel.send(f"Welcome channel set to: {channel.name}")
-                else:
-                    await message.channel.send("Server config not found.")
-            else:
-                await message.channel.send("Invalid channel ID or channel does not belong to this server.")
-        except ValueError:
-            await message.channel.send("Please provide a valid channel ID.")
-    elif command[0] == "!setwelcomerole":
-        if len(command) < 2:
-            await message.channel.send("Please provide a role ID.")
-            return
-        try:
-            if command[1] == "-1":
-                role_id = -1
-            else:
-                role_id = int(command[1].replace("<@&", "").replace(">", ""))
-            server_config = server_configs.get(message.guild.id)
-            if server_config:
-                if role_id != -1:
-                    role = message.guild.get_role(role_id)
-                    if role:
-                        server_config.welcome_role_id = role_id
-                        server_config.save_config()
-                        await message.channel.send(f"Welcome role set to: {role.name}")
-                    else:
-                        await message.channel.send("Invalid role ID.")
-                else:
-                    server_config.welcome_role_id = role_id
-                    server_config.save_config()
-                    await message.channel.send("Welcome role cleared.")
-            else:
-                await message.channel.send("Server config not found.")
-        except ValueError:
-            await message.channel.send("Please provide a valid role ID.")
-    elif command[0] == "!listmessages":
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            if not server_config.messages:
-                await message.channel.send("No messages configured.")
-            else:
-                lines = ["Configured messages:"]
-                for msg_id, msg in server_config.messages.items():
-                    content = msg.get("content", "")
-                    preview = content[:30] + ("..." if len(content) > 30 else "")
-                    lines.append(f"`{msg_id}`: {preview}")
-                    buttons = msg.get("buttons", [])
-                    if buttons:
-                        for idx, btn in enumerate(buttons, start=1):
-                            label = btn.get("label", "(no label)")
-                            target = btn.get("target", "(no target)")
-                            lines.append(f"- [{idx}] {label} -> {target}")
-                await message.channel.send("\n".join(lines))
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!setmessage":
-        if len(command) < 3:
-            await message.channel.send("Usage: !setmessage <message_id> <message>")
-            return
-        message_id = command[1]
-        message_content = " ".join(command[2:])
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            server_config.set_message(message_id, message_content)
-            await message.channel.send(f"Message '{message_id}' set to: {message_content}")
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!setbutton":
-        if len(command) < 4:
-            await message.channel.send("Usage: !setbutton <message_id> <target_message_id> <button_label>")
-            return
-        message_id = command[1]
-        target_message_id = command[2]
-        button_label = " ".join(command[3:])
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            if server_config.get_message(message_id):
-                server_config.set_button(message_id, button_label, target_message_id)
-                await message.channel.send(f"Button '{button_label}' added to message '{message_id}' linking to '{target_message_id}'.")
-            else:
-                await message.channel.send(f"Message ID '{message_id}' not found.")
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!sendmessage":
-        if len(command) < 2:
-            await message.channel.send("Usage: !sendmessage <message_id>")
-            return
-        message_id = command[1]
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            msg = server_config.get_message(message_id)
-            if msg:
-                await send_button_message(message.channel, message_id)
-            else:
-                await message.channel.send(f"Message ID '{message_id}' not found.")
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!deletemessage":
-        if len(command) < 2:
-            await message.channel.send("Usage: !deletemessage <message_id>")
-            return
-        message_id = command[1]
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            if server_config.get_message(message_id):
-                del server_config.messages[message_id]
-                server_config.save_config()
-                await message.channel.send(f"Message ID '{message_id}' deleted.")
-            else:
-                await message.channel.send(f"Message ID '{message_id}' not found.")
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!deletebutton":
-        if len(command) < 3:
-            await message.channel.send("Usage: !deletebutton <message_id> <button_label>")
-            return
-        message_id = command[1]
-        button_label = " ".join(command[2:])
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            msg = server_config.get_message(message_id)
-            if msg:
-                buttons = msg.get("buttons", [])
-                new_buttons = [btn for btn in buttons if btn.get("label") != button_label]
-                if len(new_buttons) != len(buttons):
-                    server_config.set_message(message_id, msg.get("content", ""), new_buttons)
-                    await message.channel.send(f"Button '{button_label}' deleted from message '{message_id}'.")
-                else:
-                    await message.channel.send(f"Button '{button_label}' not found in message '{message_id}'.")
-            else:
-                await message.channel.send(f"Message ID '{message_id}' not found.")
-        else:
-            await message.channel.send("Server config not found.")
-    elif command[0] == "!welcomeonjoinenabled":
-        if len(command) < 2:
-            await message.channel.send("Usage: !welcomeonjoinenabled <true|false>")
-            return
-        value = command[1].lower()
-        if value not in ("true", "false"):
-            await message.channel.send("Please provide 'true' or 'false'.")
-            return
-        enabled = value == "true"
+    command, args, error = commands.parse(message.content)
+    if command is None:
+        return
+    if error is not None:
+        await message.channel.send(error)
+        return
+
+    server_config = None
+    if command.needs_config:
         server_config = server_configs.get(message.guild.id)
-        if server_config:
-            server_config.send_welcome_on_join = enabled
-            server_config.save_config()
-            status = "enabled" if enabled else "disabled"
-            await message.channel.send(f"Welcome on join has been {status}.")
-        else:
+        if not server_config:
             await message.channel.send("Server config not found.")
-    elif command[0] == "!addroletrigger":
-        if len(command) < 4:
-            await message.channel.send("Usage: !addroletrigger <role_id> <message_id> <priority (int)>")
             return
-        try:
-            role_id = int(command[1].replace("<@&", "").replace(">", ""))
-            message_id = command[2]
-            priority = int(command[3])
-            server_config = server_configs.get(message.guild.id)
-            if server_config:
-                server_config.set_role_trigger(role_id, message_id, priority)
-                await message.channel.send(f"Role trigger added: Role ID '{role_id}' will send message '{message_id}' with priority {priority}.")
-            else:
-                await message.channel.send("Server config not found.")
-        except ValueError:
-            await message.channel.send("Please provide valid role ID and priority.")
-    elif command[0] == "!deleteroletrigger":
-        if len(command) < 2:
-            await message.channel.send("Usage: !deleteroletrigger <role_id>")
-            return
-        try:
-            role_id = int(command[1].replace("<@&", "").replace(">", ""))
-            server_config = server_configs.get(message.guild.id)
-            if server_config:
-                if str(role_id) in server_config.role_triggers:
-                    del server_config.role_triggers[str(role_id)]
-                    server_config.save_config()
-                    await message.channel.send(f"Role trigger for Role ID '{role_id}' deleted.")
-                else:
-                    await message.channel.send(f"No role trigger found for Role ID '{role_id}'.")
-            else:
-                await message.channel.send("Server config not found.")
-        except ValueError:
-            await message.channel.send("Please provide a valid role ID.")
-    elif command[0] == "!listroletriggers":
-        server_config = server_configs.get(message.guild.id)
-        if server_config:
-            if not server_config.role_triggers:
-                await message.channel.send("No role triggers configured.")
-            else:
-                lines = ["Configured role triggers:"]
-                for role_id, trigger in server_config.role_triggers.items():
-                    message_id = trigger.get("message_id", "(no message)")
-                    priority = trigger.get("priority", 0)
-                    role = message.guild.get_role(int(role_id))
-                    role_name = role.name if role else f"Role ID {role_id}"
-                    lines.append(f"- {role_name} (ID: {role_id}): Message ID '{message_id}', Priority {priority}")
-                await message.channel.send("\n".join(lines))
+
+    start = time.perf_counter()
+    try:
+        await command.handler(message, server_config, *args)
+    finally:
+        bot_metrics.inc('command_total', command=command.name)
+        bot_metrics.observe('command_seconds', time.perf_counter() - start, command=command.name)
+
+
+commands = Command_registry()
+
+
+async def send_lines(channel, lines):
+    # sends lines as one message per page, so long output doesn't break discord's message length limit
+    for page in paginate(lines):
+        await channel.send(page)
+
+
+@commands.command("!help", needs_config=False, description="Show this list of commands.")
+async def help_command(message: discord.Message, server_config: None):
+    await send_lines(message.channel, ["Available commands:"] + commands.help_lines())
+
+
+@commands.command("!init", needs_config=False, description="Initialize server config (only if not already initialized).")
+async def init_command(message: discord.Message, server_config: None):
+    if server_configs.get(message.guild.id):
+        await message.channel.send("Server config already initialized.")
+        return
+    config = Server_config()
+    config.server_id = message.guild.id
+    config.welcome_channel_id = -1
+    config.welcome_role_id = -1
+    config.send_welcome_on_join = True
+    config.save_config()
+    server_configs[message.guild.id] = config
+    await message.channel.send("Server config initialized, please use `!setmessage welcome <message>` to set the welcome message and `!setwelcomechannel <channel_id>` to set the welcome channel.")
+
+
+@commands.command(
+    "!setwelcomechannel", [parse_channel],
+    usage="!setwelcomechannel <channel_id>",
+    description="Set the welcome channel by ID.",
+    missing_message="Please provide a channel ID.",
+    invalid_message="Please provide a valid channel ID.",
+)
+async def set_welcome_channel_command(message: discord.Message, server_config: Server_config, channel_id: int):
+    channel = client.get_channel(channel_id)
+    if channel and channel.guild.id == message.guild.id:
+        server_config.welcome_channel_id = channel_id
+        server_config.save_settings()
+        await message.channel.send(f"Welcome channel set to: {channel.name}")
+    else:
+        await message.channel.send("Invalid channel ID or channel does not belong to this server.")
+
+
+@commands.command(
+    "!setwelcomerole", [parse_role],
+    usage="!setwelcomerole <role_id>",
+    description="Set the welcome role by ID. Welcome message will be sent in reaction to role addition.",
+    missing_message="Please provide a role ID.",
+    invalid_message="Please provide a valid role ID.",
+)
+async def set_welcome_role_command(message: discord.Message, server_config: Server_config, role_id: int):
+    if role_id == -1:
+        server_config.welcome_role_id = role_id
+        server_config.save_settings()
+        await message.channel.send("Welcome role cleared.")
+        return
+    role = message.guild.get_role(role_id)
+    if role:
+        server_config.welcome_role_id = role_id
+        server_config.save_settings()
+        await message.channel.send(f"Welcome role set to: {role.name}")
+    else:
+        await message.channel.send("Invalid role ID.")
+
+
+@commands.command(
+    "!setmessage", [parse_str, parse_str], rest=True,
+    usage="!setmessage <message_id> <message>",
+    description="Set a message by ID (ID \"welcome\" is the welcome message that gets sent into the specified welcome channel). Use \"<user>\" in the message text to mention the user, \"<role>\" for the role that triggered it, \"<server>\" for the server name and \"<member_count>\" for the member count.",
+)
+async def set_message_command(message: discord.Message, server_config: Server_config, message_id: str, message_content: str):
+    try:
+        server_config.set_message(message_id, message_content)
+    except ValueError as e:
+        await message.channel.send(str(e))
+        return
+    await message.channel.send(f"Message '{message_id}' set to: {message_content}")
+
+
+@commands.command(
+    "!listmessages", [parse_int], optional=1,
+    usage="!listmessages [page]",
+    description="List all configured messages.",
+    invalid_message="Please provide a valid page number.",
+)
+async def list_messages_command(message: discord.Message, server_config: Server_config, page: int = 1):
+    if not server_config.messages:
+        await message.channel.send("No messages configured.")
+        return
+    # in navigation order from the welcome and role trigger messages, then the ones no button leads to
+    graph = server_config.build_graph()
+    entry_points = server_config.entry_points()
+    lines = []
+    for msg_id in graph.walk(entry_points) + graph.unreachable(entry_points):
+        msg = server_config.messages[msg_id]
+        content = msg.content
+        preview = content[:30] + ("..." if len(content) > 30 else "")
+        lines.append(f"`{msg_id}`: {preview}")
+        for idx, btn in enumerate(msg.buttons, start=1):
+            missing = "" if btn.target in graph else " (missing)"
+            lines.append(f"- [{idx}] {btn.label} -> {btn.target}{missing}")
+    pages = paginate(lines)
+    if not 1 <= page <= len(pages):
+        await message.channel.send(f"Please provide a page between 1 and {len(pages)}.")
+        return
+    footer = f"\nPage {page}/{len(pages)}, use `!listmessages <page>` to see the others." if len(pages) > 1 else ""
+    await message.channel.send(f"Configured messages:\n{pages[page - 1]}{footer}")
+
+
+@commands.command("!checkmessages", description="Check the buttons between messages for missing targets, unreachable messages and cycles.")
+async def check_messages_command(message: discord.Message, server_config: Server_config):
+    graph = server_config.build_graph()
+    dangling = graph.dangling()
+    unreachable = graph.unreachable(server_config.entry_points())
+    cycles = graph.cycles()
+    if not dangling and not unreachable and not cycles:
+        await message.channel.send("No problems found.")
+        return
+    lines = []
+    if dangling:
+        lines.append("Buttons linking to missing messages:")
+        lines.extend(f"- `{source}` -> `{target}`" for source, target in dangling)
+    if unreachable:
+        lines.append("Messages that can't be reached from the welcome or role trigger messages:")
+        lines.append(", ".join(f"`{msg_id}`" for msg_id in unreachable))
+    if cycles:
+        lines.append("Cycles (fine for back buttons):")
+        lines.extend("- " + " -> ".join(f"`{msg_id}`" for msg_id in cycle) for cycle in cycles)
+    await send_lines(message.channel, lines)
+
+
+@commands.command("!exportconfig", description="Export this server's config as a JSON file.")
+async def export_config_command(message: discord.Message, server_config: Server_config):
+    config = server_config.to_dict()
+    # encoded in chunks off the event loop, big configs never block it or get built up as one string
+    data = await asyncio.to_thread(encode_config, config)
+    await message.channel.send(
+        "Server config, edit it and send it back with `!importconfig` to apply all changes at once.",
+        file=discord.File(data, filename=f"{message.guild.id}.json"),
+    )
+
+
+def encode_config(config):
+    data = io.BytesIO()
+    for chunk in json.JSONEncoder(indent=4).iterencode(config):
+        data.write(chunk.encode())
+    data.seek(0)
+    return data
+
+
+@commands.command(
+    "!importconfig", needs_config=False,
+    usage="!importconfig (with the config file attached)",
+    description="Replace this server's config with an attached JSON file (as made by !exportconfig), the whole file is checked before anything is changed.",
+)
+async def import_config_command(message: discord.Message, server_config: None):
+    if not message.attachments:
+        await message.channel.send("Please attach a config file.")
+        return
+    attachment = message.attachments[0]
+    if attachment.size > MAX_IMPORT_SIZE:
+        await message.channel.send(f"The config file is too large (limit is {MAX_IMPORT_SIZE // 1024 // 1024} MiB).")
+        return
+    raw = await attachment.read()
+    # parsing and checking a big file happens off the event loop
+    new_config, errors = await asyncio.to_thread(parse_config, raw, message.guild.id)
+    if new_config is not None:
+        errors = []
+        channel = client.get_channel(new_config.welcome_channel_id) if new_config.welcome_channel_id != -1 else None
+        if new_config.welcome_channel_id != -1 and (channel is None or channel.guild.id != message.guild.id):
+            errors.append("'welcome_channel_id' is not a channel of this server.")
+    if errors:
+        lines = ["The config was not imported:"] + [f"- {error}" for error in errors[:MAX_LISTED_ERRORS]]
+        if len(errors) > MAX_LISTED_ERRORS:
+            lines.append(f"... and {len(errors) - MAX_LISTED_ERRORS} more.")
+        await send_lines(message.channel, lines)
+        return
+
+    server_config = server_configs.get(message.guild.id)
+    if server_config is None:
+        server_config = Server_config()
+        server_config.server_id = message.guild.id
+        server_configs[message.guild.id] = server_config
+    changed_messages, changed_triggers = server_config.import_config(new_config)
+    await message.channel.send(f"Config imported: {len(changed_messages)} messages and {len(changed_triggers)} role triggers changed.")
+
+
+@commands.command(
+    "!setbutton", [parse_str, parse_str, parse_str], rest=True,
+    usage="!setbutton <message_id> <target_message_id> <button_label>",
+    description="Add a button to a message.",
+)
+async def set_button_command(message: discord.Message, server_config: Server_config, message_id: str, target_message_id: str, button_label: str):
+    if server_config.get_message(message_id):
+        server_config.set_button(message_id, button_label, target_message_id)
+        await message.channel.send(f"Button '{button_label}' added to message '{message_id}' linking to '{target_message_id}'.")
+    else:
+        await message.channel.send(f"Message ID '{message_id}' not found.")
+
+
+@commands.command(
+    "!sendmessage", [parse_str],
+    usage="!sendmessage <message_id>",
+    description="Send a configured message to the current channel for debugging.",
+)
+async def send_message_command(message: discord.Message, server_config: Server_config, message_id: str):
+    if server_config.get_message(message_id):
+        await send_button_message(message.channel, message_id)
+    else:
+        await message.channel.send(f"Message ID '{message_id}' not found.")
+
+
+@commands.command(
+    "!deletemessage", [parse_str],
+    usage="!deletemessage <message_id>",
+    description="Delete a configured message by ID.",
+)
+async def delete_message_command(message: discord.Message, server_config: Server_config, message_id: str):
+    if server_config.delete_message(message_id):
+        linked_from = sorted(server_config.linked_from(message_id))
+        if linked_from:
+            sources = ", ".join(f"'{source}'" for source in linked_from)
+            await message.channel.send(f"Message ID '{message_id}' deleted, buttons in {sources} still link to it and are disabled.")
         else:
-            await message.channel.send("Server config not found.")
+            await message.channel.send(f"Message ID '{message_id}' deleted.")
+    else:
+        await message.channel.send(f"Message ID '{message_id}' not found.")
+
+
+@commands.command(
+    "!deletebutton", [parse_str, parse_str], rest=True,
+    usage="!deletebutton <message_id> <button_label>",
+    description="Delete a button from a message by its label.",
+)
+async def delete_button_command(message: discord.Message, server_config: Server_config, message_id: str, button_label: str):
+    msg = server_config.get_message(message_id)
+    if not msg:
+        await message.channel.send(f"Message ID '{message_id}' not found.")
+        return
+    new_buttons = [btn for btn in msg.buttons if btn.label != button_label]
+    if len(new_buttons) != len(msg.buttons):
+        server_config.set_message(message_id, msg.content, new_buttons)
+        await message.channel.send(f"Button '{button_label}' deleted from message '{message_id}'.")
+    else:
+        await message.channel.send(f"Button '{button_label}' not found in message '{message_id}'.")
+
+
+@commands.command(
+    "!welcomeonjoinenabled", [parse_bool],
+    usage="!welcomeonjoinenabled <true|false>",
+    description="Enable or disable welcome messages on member join.",
+    invalid_message="Please provide 'true' or 'false'.",
+)
+async def welcome_on_join_command(message: discord.Message, server_config: Server_config, enabled: bool):
+    server_config.send_welcome_on_join = enabled
+    server_config.save_settings()
+    status = "enabled" if enabled else "disabled"
+    await message.channel.send(f"Welcome on join has been {status}.")
+
+
+@commands.command(
+    "!addroletrigger", [parse_role, parse_str, parse_int],
+    usage="!addroletrigger <role_id> <message_id> <priority (int)>",
+    description="Send a message when a user is given a specific role, if multiple roles get added at once the highest prio one gets sent.",
+    invalid_message="Please provide valid role ID and priority.",
+)
+async def add_role_trigger_command(message: discord.Message, server_config: Server_config, role_id: int, message_id: str, priority: int):
+    server_config.set_role_trigger(role_id, message_id, priority)
+    await message.channel.send(f"Role trigger added: Role ID '{role_id}' will send message '{message_id}' with priority {priority}.")
+    await cache_members_for_role_triggers(message.guild, server_config)
+
+
+@commands.command(
+    "!deleteroletrigger", [parse_role],
+    usage="!deleteroletrigger <role_id>",
+    description="Delete a role trigger.",
+    invalid_message="Please provide a valid role ID.",
+)
+async def delete_role_trigger_command(message: discord.Message, server_config: Server_config, role_id: int):
+    if server_config.delete_role_trigger(role_id):
+        await message.channel.send(f"Role trigger for Role ID '{role_id}' deleted.")
+    else:
+        await message.channel.send(f"No role trigger found for Role ID '{role_id}'.")
+
+
+@commands.command(
+    "!setroledebounce", [parse_float],
+    usage="!setroledebounce <seconds>",
+    description=f"Collect roles added to a member within this many seconds and only send the highest priority trigger once (0 to {MAX_ROLE_DEBOUNCE:g}, 0 sends every trigger right away).",
+    invalid_message=f"Please provide a number of seconds between 0 and {MAX_ROLE_DEBOUNCE:g}.",
+)
+async def set_role_debounce_command(message: discord.Message, server_config: Server_config, seconds: float):
+    if not 0 <= seconds <= MAX_ROLE_DEBOUNCE:
+        await message.channel.send(f"Please provide a number of seconds between 0 and {MAX_ROLE_DEBOUNCE:g}.")
+        return
+    server_config.role_debounce_seconds = seconds
+    server_config.save_settings()
+    await message.channel.send(f"Role updates are now collected for {seconds:g} seconds." if seconds else "Role triggers are now sent right away.")
+
+
+@commands.command("!listroletriggers", description="List all role triggers for this server.")
+async def list_role_triggers_command(message: discord.Message, server_config: Server_config):
+    if not server_config.role_triggers:
+        await message.channel.send("No role triggers configured.")
+        return
+    lines = ["Configured role triggers:"]
+    for role_id, trigger in server_config.role_triggers.items():
+        role = message.guild.get_role(role_id)
+        role_name = role.name if role else f"Role ID {role_id}"
+        lines.append(f"- {role_name} (ID: {role_id}): Message ID '{trigger.message_id}', Priority {trigger.priority}")
+    await send_lines(message.channel, lines)
+
+
+def render_button_message(guild_id: int, message_id: str, addressed_users: list, role_id: Optional[int] = None):
+    """
+    Build the content and view of a configured message, or None if it doesn't exist.
+    All addressed users are mentioned in place of "<user>", "<role>" mentions the role that triggered the message.
+    """
+    server_config = server_configs.get(guild_id)
+    if not server_config:
+        return None
+
+    msg = server_config.get_message(message_id)
+    if not msg:
+        return None
+
+    view = view_cache.get(guild_id, message_id, msg, server_config.messages)
+    return msg.template.render(template_values(guild_id, msg, addressed_users, role_id)), view
+
+
+def template_values(guild_id: int, msg, addressed_users: list, role_id: Optional[int] = None):
+    values = {}
+    if addressed_users:
+        values["user"] = ", ".join(f"<@{user.id}>" for user in addressed_users)
+    if role_id is not None:
+        values["role"] = f"<@&{role_id}>"
+    placeholders = msg.template.placeholders
+    if "server" in placeholders or "member_count" in placeholders:
+        guild = client.get_guild(guild_id)
+        if guild is not None:
+            values["server"] = guild.name
+            values["member_count"] = str(guild.member_count)
+    return values
 
 
 async def send_button_message(
@@ -381,41 +552,14 @@ async def send_button_message(
             resolved_guild_id = guild.id
 
     if resolved_guild_id is None:
+        bot_metrics.inc('send_button_message_total', outcome='no_guild')
         return
 
-    server_config = server_configs.get(resolved_guild_id)
-    if not server_config:
+    rendered = render_button_message(resolved_guild_id, message_id, [addressed_user] if addressed_user else [])
+    if rendered is None:
+        bot_metrics.inc('send_button_message_total', outcome='not_found')
         return
-
-    msg = server_config.get_message(message_id)
-    if not msg:
-        return
-
-    buttons = msg.get("buttons", [])
-    view = None
-    if buttons:
-        view = discord.ui.View()
-        for button in buttons:
-            next_id = button.get("target")
-            label = button.get("label", "Next")
-
-            async def button_callback(cb_interaction: discord.Interaction, next_id=next_id):
-                await send_button_message(
-                    target=None,
-                    message_id=next_id,
-                    guild_id=cb_interaction.guild.id if cb_interaction.guild else resolved_guild_id,
-                    addressed_user=cb_interaction.user,
-                    interaction=cb_interaction,
-                    ephemeral=True,
-                )
-
-            btn = discord.ui.Button(label=label, style=discord.ButtonStyle.primary)
-            btn.callback = button_callback
-            view.add_item(btn)
-
-    content = msg["content"]
-    if addressed_user:
-        content = content.replace("<user>", f"<@{addressed_user.id}>")
+    content, view = rendered
 
     # If coming from an interaction and ephemeral requested, respond ephemerally
     if interaction is not None and ephemeral:
@@ -427,6 +571,7 @@ async def send_button_message(
             await interaction.response.send_message(**send_kwargs)
         else:
             await interaction.followup.send(**send_kwargs)
+        bot_metrics.inc('send_button_message_total', outcome='ephemeral')
         return
 
     # Fallback: normal send to target (public message)
@@ -435,7 +580,171 @@ async def send_button_message(
             await target.send(content=content)
         else:
             await target.send(content=content, view=view)
+        bot_metrics.inc('send_button_message_total', outcome='sent')
+
+
+@bot_metrics.timed('button_click')
+async def on_button_click(interaction: discord.Interaction, guild_id: int, target_message_id: str):
+    # single dispatcher for every button, the guild and target come from the button's custom_id
+    outcome = sessions.click(guild_id, interaction.user.id, target_message_id)
+    if outcome is not ALLOWED:
+        # double clicks are acknowledged without a response, users clicking too fast get a short notice
+        bot_metrics.inc('button_click_dropped_total', reason=outcome)
+        if outcome is DUPLICATE:
+            await interaction.response.defer()
+        else:
+            await interaction.response.send_message(content="You're clicking too fast, please wait a moment.", ephemeral=True)
+        return
+
+    cached = view_cache.lookup(guild_id, target_message_id)
+    if cached is not None:
+        # fast path: the response is compiled already, answer right away
+        msg, view = cached
+        send_kwargs = {"content": msg.template.render(template_values(guild_id, msg, [interaction.user])), "ephemeral": True}
+        if view is not None:
+            send_kwargs["view"] = view
+        await interaction.response.send_message(**send_kwargs)
+        record_button_ack(interaction, 'fast')
+        return
+
+    # buttons on messages sent before their target was deleted, answered right away if the config is loaded
+    server_config = server_configs.loaded.get(guild_id)
+    if server_config is not None and target_message_id not in server_config.messages:
+        await interaction.response.send_message(content="This message is no longer available.", ephemeral=True)
+        record_button_ack(interaction, 'missing')
+        return
+
+    # slow path: acknowledge first so the config lookup can't push us past discord's 3 second deadline
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    record_button_ack(interaction, 'deferred')
+    rendered = render_button_message(guild_id, target_message_id, [interaction.user])
+    if rendered is None:
+        await interaction.followup.send(content="This message is no longer available.", ephemeral=True)
+        return
+    content, view = rendered
+    send_kwargs = {"content": content, "ephemeral": True}
+    if view is not None:
+        send_kwargs["view"] = view
+    await interaction.followup.send(**send_kwargs)
+
+
+def record_button_ack(interaction: discord.Interaction, path: str):
+    # time from the click (the interaction's snowflake timestamp) until discord got our response
+    bot_metrics.observe('button_ack_seconds', (discord.utils.utcnow() - interaction.created_at).total_seconds(), path=path)
+
+
+def collect_gauges():
+    gauges = {
+        ('send_queue_depth', ()): send_queue.depth(),
+        ('config_writer_dirty_guilds', ()): len(config_writer.dirty),
+        ('config_registry_loaded_guilds', ()): len(server_configs.loaded),
+        ('compiled_responses', ()): len(view_cache),
+        ('navigation_sessions', ()): len(sessions),
+        ('role_updates_pending', ()): len(role_debouncer),
+    }
+    for name, value in send_queue.stats.items():
+        gauges[(f'send_queue_{name}', ())] = value
+    return gauges
+
+
+EVENT_HANDLERS = (
+    setup_hook,
+    on_guild_available,
+    on_ready,
+    on_member_join,
+    on_member_update,
+    on_message,
+)
+
+
+def create_app(bot_client=None, storage=None):
+    """
+    Build the bot: storage, config registry, caches and queues, and register the event handlers.
+    - Without arguments everything is configured from the environment, like when running main.py.
+    - bot_client and storage replace the discord client and config storage, e.g. with local stand-ins.
+    """
+    global client, config_writer, server_configs, view_cache, send_queue, config_watcher, sessions, role_debouncer
+    global config_snapshot_path
+
+    # configs are stored as one json file per guild unless a sqlite database is configured
+    if storage is not None:
+        Server_config.storage = storage
+    elif os.environ.get(constants.SQLITE_PATH_VARIABLE):
+        Server_config.storage = Sqlite_storage(os.environ.get(constants.SQLITE_PATH_VARIABLE))
+    else:
+        os.makedirs('config', exist_ok=True)
+
+    # lean mode drops the presence intent and only caches members that joined while the bot is online
+    # with a shard count (and optionally shard ids, as set by cluster.py) the bot runs as an AutoShardedClient
+    shard_count = int(os.environ[constants.SHARD_COUNT_VARIABLE]) if os.environ.get(constants.SHARD_COUNT_VARIABLE) else None
+    shard_ids = parse_shard_ids(os.environ[constants.SHARD_IDS_VARIABLE]) if os.environ.get(constants.SHARD_IDS_VARIABLE) else None
+    if bot_client is None:
+        bot_client = create_client(
+            lean=os.environ.get(constants.LEAN_MODE_VARIABLE, '').lower() in ('1', 'true'),
+            commands_enabled=os.environ.get(constants.DISABLE_COMMANDS_VARIABLE, '').lower() not in ('1', 'true'),
+            shard_count=shard_count,
+            shard_ids=shard_ids,
+            sharded=os.environ.get(constants.SHARDED_VARIABLE, '').lower() in ('1', 'true'),
+        )
+    client = bot_client
+
+    # config saves are batched and written in the background instead of blocking the event loop
+    config_writer = Config_writer()
+    Server_config.writer = config_writer
+
+    # server configs are only indexed here, each one is loaded on first access or when its guild becomes available
+    owned_shards = set(shard_ids) if shard_count is not None and shard_ids is not None else None
+    view_cache = View_cache(client, on_button_click)
+    Server_config.view_cache = view_cache
+    server_configs = Config_registry(
+        writer=config_writer,
+        owns=(lambda guild_id: shard_for_guild(guild_id, shard_count) in owned_shards) if owned_shards is not None else None,
+        # compiled responses go together with the config they were built from
+        on_evict=view_cache.forget_guild,
+    )
+    # json configs that haven't changed since the last shutdown are taken from the snapshot instead of being parsed again
+    config_snapshot_path = None
+    if isinstance(Server_config.storage, Json_storage):
+        config_snapshot_path = os.path.join(Server_config.storage.config_dir, snapshot_file(shard_count, shard_ids))
+        used = server_configs.load_snapshot(config_snapshot_path)
+        if used:
+            print(f"loaded {used} server configs from the config snapshot")
+
+    send_queue = Send_queue(render_button_message)
+    sessions = Session_store()
+    role_debouncer = Role_debouncer(send_role_trigger_message)
+
+    # config files edited by hand are picked up without a restart, only the changed guild is reparsed
+    if os.environ.get(constants.WATCH_CONFIG_VARIABLE, '').lower() in ('1', 'true') and isinstance(Server_config.storage, Json_storage):
+        from config_watcher import Config_watcher
+        config_watcher = Config_watcher(server_configs)
+
+    for handler in EVENT_HANDLERS:
+        client.event(handler)
+    bot_metrics.add_collector(collect_gauges)
+    http_logger = logging.getLogger('discord.http')
+    if not any(isinstance(handler, Rate_limit_log_handler) for handler in http_logger.handlers):
+        http_logger.addHandler(Rate_limit_log_handler())
+    return client
+
+
+def save_config_snapshot():
+    if config_snapshot_path is not None:
+        try:
+            server_configs.save_snapshot(config_snapshot_path)
+        except OSError as e:
+            print(f"failed to write the config snapshot: {e}")
+
 
+def run():
+    create_app()
+    try:
+        client.run(os.environ.get(constants.BOT_TOKEN_VARIABLE))
+    finally:
+        # make sure pending edits hit the disk before the process exits, then snapshot what is loaded for the next start
+        config_writer.flush_now()
+        save_config_snapshot()
 
-client.run(os.environ.get(constants.BOT_TOKEN_VARIABLE))
 
+if __name__ == '__main__':
+    run()
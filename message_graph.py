@@ -0,0 +1,75 @@
+from collections import deque
+
+# navigation graph of a guild's messages, every button is an edge from its message to its target
+# built from a guild's messages when a command or the startup compile needs to know which buttons point at
+# deleted messages, what users can reach and where the cycles are, and thrown away afterwards
+
+
+class Message_graph:
+    def __init__(self, messages):
+        # {message_id: tuple of target message ids, in button order}
+        self.targets = {}
+        # {target message id: set of message ids with a button linking to it}, targets may not exist
+        self.sources = {}
+        for message_id, msg in messages.items():
+            targets = tuple(dict.fromkeys(btn.target for btn in msg.buttons))
+            self.targets[message_id] = targets
+            for target in targets:
+                self.sources.setdefault(target, set()).add(message_id)
+
+    def __contains__(self, message_id):
+        return message_id in self.targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    def dangling(self):
+        # [(message_id, missing target)] for every button that leads nowhere
+        return sorted(
+            (source, target)
+            for target, sources in self.sources.items() if target not in self.targets
+            for source in sources
+        )
+
+    def walk(self, roots):
+        # message ids reachable from roots (the entry points users start at), in the order they are reached
+        order = []
+        seen = set()
+        queue = deque(root for root in roots if root in self.targets)
+        while queue:
+            message_id = queue.popleft()
+            if message_id in seen:
+                continue
+            seen.add(message_id)
+            order.append(message_id)
+            queue.extend(target for target in self.targets[message_id] if target in self.targets and target not in seen)
+        return order
+
+    def unreachable(self, roots):
+        reachable = set(self.walk(roots))
+        return [message_id for message_id in self.targets if message_id not in reachable]
+
+    def cycles(self):
+        # one cycle (as a list of message ids) per button that links back to a message on the current path,
+        # these aren't errors, "back" buttons make them, but a menu nobody can leave usually is a mistake
+        cycles = []
+        done = set()
+        for start in self.targets:
+            if start in done:
+                continue
+            path = [start]
+            on_path = {start: 0}
+            stack = [iter(self.targets[start])]
+            while stack:
+                target = next(stack[-1], None)
+                if target is None:
+                    stack.pop()
+                    done.add(path[-1])
+                    del on_path[path.pop()]
+                elif target in on_path:
+                    cycles.append(path[on_path[target]:] + [target])
+                elif target in self.targets and target not in done:
+                    on_path[target] = len(path)
+                    path.append(target)
+                    stack.append(iter(self.targets[target]))
+        return cycles
@@ -0,0 +1,193 @@
+import bisect
+import collections
+import functools
+import logging
+import sys
+import threading
+import time
+
+# lightweight in-process metrics
+# counters and latency histograms are kept in bot_metrics and served in the prometheus text format
+# on a local http endpoint, together with an optional sampling profiler that can be switched on at runtime
+
+# latency buckets in seconds, dense around discord's 3 second interaction deadline
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 2.5, 3.0, 5.0, 10.0)
+PROFILER_INTERVAL = 0.005
+PROFILER_TOP_STACKS = 50
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        # upper bound of the bucket the q-th percentile falls into
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+def format_labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        # {(name, ((label, value), ...)): value}
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        # collectors return {(name, labels): value} gauges, read when the metrics are scraped
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_collector(self, collector):
+        # adding the same collector again is a no-op, so setting the app up twice doesn't report every gauge twice
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def timed(self, name, **labels):
+        # decorator for coroutines, records a call counter and a latency histogram under name
+        def decorator(coro):
+            @functools.wraps(coro)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await coro(*args, **kwargs)
+                finally:
+                    self.inc(f'{name}_total', **labels)
+                    self.observe(f'{name}_seconds', time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def render(self):
+        # prometheus text exposition format, the dicts are copied since config saves record from the writer thread
+        lines = []
+        for (name, labels), value in sorted(self.counters.copy().items()):
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for collector in self.collectors:
+            for (name, labels), value in sorted(collector().items()):
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(self.histograms.copy().items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, ("le", "+Inf"))} {histogram.count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class Sampling_profiler:
+    # samples the stack of one thread (the event loop) from a background thread, so it can be
+    # switched on in production to see where the loop spends its time
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.thread = None
+        self.running = False
+        self.target_thread_id = None
+
+    def start(self, thread_id=None):
+        if self.running:
+            return
+        self.target_thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.samples.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_filename}:{frame.f_code.co_name}')
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def report(self):
+        # collapsed stacks (flamegraph input), most sampled first
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common(PROFILER_TOP_STACKS)) + '\n'
+
+
+class Rate_limit_log_handler(logging.Handler):
+    # discord.py logs a warning for every 429, with the retry_after it then sleeps for as the last argument.
+    # its pre-emptive waits on exhausted buckets are only logged at debug level and without a duration,
+    # so those aren't covered here
+    def emit(self, record):
+        if not isinstance(record.msg, str) or 'rate limited' not in record.msg:
+            return
+        bot_metrics.inc('discord_rate_limited_total')
+        if 'Retrying in' in record.msg and record.args and isinstance(record.args[-1], (int, float)):
+            bot_metrics.observe('discord_rate_limit_sleep_seconds', record.args[-1])
+
+
+bot_metrics = Metrics()
+profiler = Sampling_profiler()
+
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    # /metrics for prometheus, /profile/start, /profile/stop and /profile to use the sampling profiler
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(text=bot_metrics.render(), content_type='text/plain')
+
+    async def profile_start_handler(request):
+        profiler.start()
+        return web.Response(text='profiler started\n')
+
+    async def profile_stop_handler(request):
+        profiler.stop()
+        return web.Response(text='profiler stopped\n')
+
+    async def profile_handler(request):
+        return web.Response(text=profiler.report())
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/profile/start', profile_start_handler)
+    app.router.add_get('/profile/stop', profile_stop_handler)
+    app.router.add_get('/profile', profile_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
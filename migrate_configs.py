@@ -0,0 +1,38 @@
+import argparse
+from server_config import Server_config
+from storage import Config_changes, Json_storage, Sqlite_storage
+
+# imports the per-guild json configs into a sqlite database
+# usage: python migrate_configs.py bot.db [--config-dir config]
+
+
+def migrate(source, target):
+    count = 0
+    for guild_id in source.list_guild_ids():
+        config = Server_config()
+        try:
+            config.from_dict(source.load(guild_id))
+        except (OSError, ValueError) as e:
+            print(f"skipping guild {guild_id}: {e}")
+            continue
+        # files written before server_id was stored (or edited by hand) would otherwise be keyed under -1
+        config.server_id = guild_id
+        target.write(target.snapshot(config, Config_changes(full=True)))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import config/*.json server configs into a sqlite database.')
+    parser.add_argument('database', help='path of the sqlite database to create or update')
+    parser.add_argument('--config-dir', default='config', help='directory with the <guild_id>.json files')
+    args = parser.parse_args()
+
+    target = Sqlite_storage(args.database)
+    count = migrate(Json_storage(args.config_dir), target)
+    target.close()
+    print(f"migrated {count} server configs to {args.database}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from metrics import bot_metrics
+from storage import Config_changes
+
+# write-behind persistence for server configs
+# mutations only mark a guild as dirty, a background task then writes each dirty guild
+# at most once per flush interval, so bulk edits don't block the event loop with file io
+
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+class Config_writer:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.dirty = {}
+        self.task = None
+        self.wakeup = None
+
+    def mark_dirty(self, server_config, changes=None):
+        # changes defaults to a full save, they are merged until the next flush
+        if changes is None:
+            changes = Config_changes(full=True)
+        pending = self.dirty.get(server_config.server_id)
+        if pending is None:
+            self.dirty[server_config.server_id] = (server_config, changes)
+        else:
+            pending[1].merge(changes)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            # let further edits pile up so they get coalesced into one write per guild
+            await asyncio.sleep(self.flush_interval)
+            self.wakeup.clear()
+            await self.flush()
+
+    def take_dirty(self):
+        # snapshot on the loop thread so the write never sees a half-applied mutation
+        pending = []
+        for server_config, changes in self.dirty.values():
+            pending.append((server_config.storage, server_config.server_id, server_config.storage.snapshot(server_config, changes)))
+        self.dirty = {}
+        return pending
+
+    async def flush(self):
+        pending = self.take_dirty()
+        if pending:
+            await asyncio.to_thread(self.write_all, pending)
+
+    def write_all(self, pending):
+        for storage, server_id, payload in pending:
+            start = time.perf_counter()
+            try:
+                storage.write(payload)
+            except storage.errors as e:
+                bot_metrics.inc('config_save_errors_total')
+                print(f"failed to save config for guild {server_id}: {e}")
+            bot_metrics.observe('config_save_seconds', time.perf_counter() - start)
+
+    async def stop(self):
+        # flush-on-shutdown hook, cancels the background task and writes whatever is still dirty
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def flush_now(self):
+        # synchronous flush for when the event loop is already gone
+        self.write_all(self.take_dirty())
@@ -0,0 +1,95 @@
+import asyncio
+import math
+
+# per-member debounce of role additions
+# bots often grant several roles one at a time within a few hundred milliseconds, each grant being its own
+# member update. additions are collected for a short window per member and resolved together once it closes,
+# so only the highest priority role trigger is sent. the windows run on one timer wheel instead of a task per member
+
+# seconds, configurable per guild with !setroledebounce, 0 sends role trigger messages right away
+DEFAULT_ROLE_DEBOUNCE = 0.5
+MAX_ROLE_DEBOUNCE = 10.0
+DEFAULT_TICK = 0.05
+
+
+class Timer_wheel:
+    # hashed timer wheel, one slot per tick, a single task advances through the slots and fires what's due
+    def __init__(self, callback, tick=DEFAULT_TICK, max_delay=MAX_ROLE_DEBOUNCE):
+        # callback(key) is called when key's timer fires
+        self.callback = callback
+        self.tick = tick
+        self.slots = [set() for _ in range(math.ceil(max_delay / tick) + 1)]
+        self.position = 0
+        # {key: slot index}
+        self.timers = {}
+        self.task = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, key, delay):
+        # delays are rounded up to whole ticks and capped at max_delay
+        self.cancel(key)
+        ticks = min(len(self.slots) - 1, max(1, math.ceil(delay / self.tick)))
+        index = (self.position + ticks) % len(self.slots)
+        self.slots[index].add(key)
+        self.timers[key] = index
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def cancel(self, key):
+        index = self.timers.pop(key, None)
+        if index is not None:
+            self.slots[index].discard(key)
+
+    async def run(self):
+        # runs while there are timers, and is started again by the next schedule()
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while self.timers:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            # catch up on the ticks we missed if the event loop was busy
+            while next_tick <= loop.time() and self.timers:
+                next_tick += self.tick
+                self.position = (self.position + 1) % len(self.slots)
+                due = self.slots[self.position]
+                if not due:
+                    continue
+                self.slots[self.position] = set()
+                for key in due:
+                    del self.timers[key]
+                    try:
+                        self.callback(key)
+                    except Exception as e:
+                        print(f"timer for {key} failed: {e}")
+        self.task = None
+
+
+class Role_debouncer:
+    def __init__(self, flush, tick=DEFAULT_TICK):
+        # flush(member, added_role_ids) is called once per member when its window closes
+        self.flush = flush
+        # {(guild_id, member_id): [latest member, role ids added during the window]}
+        self.pending = {}
+        self.wheel = Timer_wheel(self.fire, tick)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, member, added_role_ids, window):
+        # the window starts with the first addition, later ones are merged into it so a stream of grants can't delay it
+        key = (member.guild.id, member.id)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [member, set(added_role_ids)]
+            self.wheel.schedule(key, window)
+        else:
+            entry[0] = member
+            entry[1] |= added_role_ids
+
+    def fire(self, key):
+        member, added = self.pending.pop(key)
+        # roles that were taken away again within the window don't count
+        added &= {role.id for role in member.roles}
+        if added:
+            self.flush(member, added)
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from templates import MAX_MESSAGE_LENGTH
+
+# per-channel outbound queue for welcome and role trigger messages
+# each channel gets a token bucket so we stay under discord's per-channel rate limit instead of sleeping on 429s,
+# and pending sends of the same message id are merged into one message that mentions several users
+
+# discord allows roughly 5 messages per 5 seconds per channel
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 5
+# how long a pending welcome waits for more joiners before it is sent
+DEFAULT_COALESCE_WINDOW = 1.0
+DEFAULT_MAX_MENTIONS = 20
+
+
+class Token_bucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # returns how long we had to wait for a token
+        waited = 0.0
+        self.refill()
+        while self.tokens < 1:
+            delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+            self.refill()
+        self.tokens -= 1
+        return waited
+
+
+class Pending_send:
+    def __init__(self, guild_id, message_id, users, role_id=None):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.users = users
+        self.role_id = role_id
+        self.created = time.monotonic()
+
+
+class Send_queue:
+    def __init__(self, render, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 coalesce_window=DEFAULT_COALESCE_WINDOW, max_mentions=DEFAULT_MAX_MENTIONS):
+        # render(guild_id, message_id, users, role_id) returns (content, view), or None if the message no longer exists
+        self.render = render
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_window = coalesce_window
+        self.max_mentions = max_mentions
+        self.pending = {}
+        self.buckets = {}
+        self.workers = {}
+        self.stats = {
+            'queued': 0,
+            'sent': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'max_depth': 0,
+            'rate_limit_sleep': 0.0,
+        }
+
+    def depth(self, channel_id=None):
+        # back-pressure: number of pending sends for one channel, or for all of them
+        if channel_id is not None:
+            return len(self.pending.get(channel_id, ()))
+        return sum(len(pending) for pending in self.pending.values())
+
+    def enqueue(self, channel, guild_id, message_id, user=None, role_id=None):
+        self.stats['queued'] += 1
+        pending = self.pending.setdefault(channel.id, [])
+        if user is not None:
+            # merge into a pending send of the same message that still has room for another mention
+            for entry in pending:
+                if (entry.message_id == message_id and entry.guild_id == guild_id and entry.role_id == role_id
+                        and 0 < len(entry.users) < self.max_mentions):
+                    entry.users.append(user)
+                    self.stats['coalesced'] += 1
+                    return
+        pending.append(Pending_send(guild_id, message_id, [user] if user is not None else [], role_id))
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(pending))
+
+        if channel.id not in self.workers:
+            self.workers[channel.id] = asyncio.get_running_loop().create_task(self.run_channel(channel))
+
+    async def run_channel(self, channel):
+        pending = self.pending[channel.id]
+        bucket = self.buckets.get(channel.id)
+        if bucket is None:
+            bucket = self.buckets[channel.id] = Token_bucket(self.rate, self.burst)
+        try:
+            while pending:
+                # give the oldest send its coalescing window to collect more users
+                remaining = pending[0].created + self.coalesce_window - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                self.stats['rate_limit_sleep'] += await bucket.acquire()
+                await self.send(channel, pending)
+        finally:
+            del self.workers[channel.id]
+            if not pending:
+                del self.pending[channel.id]
+
+    async def send(self, channel, pending):
+        entry = pending.pop(0)
+        rendered = self.render(entry.guild_id, entry.message_id, entry.users, entry.role_id)
+        # split the mentions back up until the merged message fits
+        while rendered is not None and len(rendered[0]) > MAX_MESSAGE_LENGTH and len(entry.users) > 1:
+            half = len(entry.users) // 2
+            rest = Pending_send(entry.guild_id, entry.message_id, entry.users[half:], entry.role_id)
+            rest.created = entry.created
+            pending.insert(0, rest)
+            entry.users = entry.users[:half]
+            rendered = self.render(entry.guild_id, entry.message_id, entry.users, entry.role_id)
+        if rendered is None:
+            self.stats['dropped'] += 1
+            return
+
+        content, view = rendered
+        try:
+            if view is None:
+                await channel.send(content=content)
+            else:
+                await channel.send(content=content, view=view)
+            self.stats['sent'] += 1
+        except Exception as e:
+            self.stats['dropped'] += 1
+            print(f"failed to send message '{entry.message_id}' to channel {channel.id}: {e}")
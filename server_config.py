@@ -1,65 +1,318 @@
+import json
+from storage import Config_changes, Json_storage
+from templates import MAX_MESSAGE_LENGTH, Template
+from message_graph import Message_graph
+from role_debounce import DEFAULT_ROLE_DEBOUNCE, MAX_ROLE_DEBOUNCE
+
+
+# the config is parsed into these slotted records once when it is loaded,
+# so hot paths use attribute access instead of dict lookups and each instance stays small
+
+class Button:
+	__slots__ = ('label', 'target')
+
+	def __init__(self, label, target):
+		self.label = label
+		self.target = target
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data.get('label', 'Next'), data.get('target'))
+
+	def __reduce__(self):
+		# pickled as plain arguments, much smaller and faster to load for the config snapshot than slot state
+		return Button, (self.label, self.target)
+
+	def to_dict(self):
+		return {'label': self.label, 'target': self.target}
+
+
+class Message:
+	__slots__ = ('buttons', 'template')
+
+	def __init__(self, content, buttons=None):
+		self.buttons = buttons if buttons is not None else []
+		self.template = Template(content)
+
+	@property
+	def content(self):
+		# not stored twice, the template's segments join back into the exact text
+		return self.template.source()
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data.get('content', ''), [Button.from_dict(btn) for btn in data.get('buttons') or []])
+
+	def __reduce__(self):
+		return Message.restore, (self.buttons, self.template.segments, self.template.slots)
+
+	@classmethod
+	def restore(cls, buttons, segments, slots):
+		# unpickles a message with its already compiled template
+		message = cls.__new__(cls)
+		message.buttons = buttons
+		message.template = Template.restore(segments, slots)
+		return message
+
+	def same_as(self, other):
+		return self.content == other.content and [btn.to_dict() for btn in self.buttons] == [btn.to_dict() for btn in other.buttons]
+
+	def to_dict(self):
+		return {'content': self.content, 'buttons': [btn.to_dict() for btn in self.buttons]}
+
+
+class Role_trigger:
+	__slots__ = ('message_id', 'priority')
+
+	def __init__(self, message_id, priority):
+		self.message_id = message_id
+		self.priority = priority
+
+	@classmethod
+	def from_dict(cls, data):
+		return cls(data['message_id'], data['priority'])
+
+	def __reduce__(self):
+		return Role_trigger, (self.message_id, self.priority)
+
+	def same_as(self, other):
+		return self.message_id == other.message_id and self.priority == other.priority
+
+	def to_dict(self):
+		return {'message_id': self.message_id, 'priority': self.priority}
+
+
 class Server_config:
-	messages = {}
-	welcome_channel_id = -1
-	server_id = -1
-	welcome_role_id = -1
-	send_welcome_on_join = False
-	role_triggers = {}
+	__slots__ = ('messages', 'welcome_channel_id', 'server_id', 'welcome_role_id', 'send_welcome_on_join', 'role_triggers', 'role_debounce_seconds')
+
+	# write-behind Config_writer, when set save_config only marks this config dirty
+	writer = None
+	# compiled View_cache, told about every message change so stale button views get rebuilt
+	view_cache = None
+	# storage backend the config is loaded from and saved to
+	storage = Json_storage()
 
 	def __init__(self):
-		pass
+		# {message_id: Message}
+		self.messages = {}
+		self.welcome_channel_id = -1
+		self.server_id = -1
+		self.welcome_role_id = -1
+		self.send_welcome_on_join = False
+		# {role_id (int): Role_trigger}, keyed by int so added roles can be intersected with it directly
+		self.role_triggers = {}
+		# role additions within this many seconds of each other are resolved together, 0 resolves every update on its own
+		self.role_debounce_seconds = DEFAULT_ROLE_DEBOUNCE
 
 	def load_config(self, server_id):
-		import json
-		with open(f'config/{server_id}.json', 'r') as f:
-			config = json.load(f)
-		self.messages = config.get('messages', {})
+		self.from_dict(self.storage.load(server_id))
+
+	def from_dict(self, config):
+		self.messages = {message_id: Message.from_dict(msg) for message_id, msg in config.get('messages', {}).items()}
 		self.welcome_channel_id = config.get('welcome_channel_id', -1)
 		self.server_id = config.get('server_id', -1)
 		self.welcome_role_id = config.get('welcome_role_id', -1)
 		self.send_welcome_on_join = config.get('send_welcome_on_join', False)
-		self.role_triggers = config.get('role_triggers', {})
-
-	def save_config(self):
-		import json
-		with open(f'config/{self.server_id}.json', 'w') as f:
-			json.dump({
-				'messages': self.messages,
-				'welcome_channel_id': self.welcome_channel_id,
-				'server_id': self.server_id,
-				'welcome_role_id': self.welcome_role_id,
-				'send_welcome_on_join': self.send_welcome_on_join,
-				'role_triggers': self.role_triggers
-			}, f, indent=4)
+		self.role_triggers = {
+			int(role_id): Role_trigger.from_dict(trigger) for role_id, trigger in config.get('role_triggers', {}).items()
+		}
+		self.role_debounce_seconds = config.get('role_debounce_seconds', DEFAULT_ROLE_DEBOUNCE)
+
+	def to_dict(self):
+		return {
+			'messages': {message_id: msg.to_dict() for message_id, msg in self.messages.items()},
+			'welcome_channel_id': self.welcome_channel_id,
+			'server_id': self.server_id,
+			'welcome_role_id': self.welcome_role_id,
+			'send_welcome_on_join': self.send_welcome_on_join,
+			'role_triggers': {str(role_id): trigger.to_dict() for role_id, trigger in self.role_triggers.items()},
+			'role_debounce_seconds': self.role_debounce_seconds,
+		}
+
+	def apply_reload(self, other):
+		# takes over a freshly loaded version of this config, only the messages that differ are replaced and
+		# invalidated so the compiled views and templates of everything else stay cached
+		changed_messages = []
+		for message_id in self.messages.keys() | other.messages.keys():
+			old = self.messages.get(message_id)
+			new = other.messages.get(message_id)
+			if old is None or new is None or not old.same_as(new):
+				changed_messages.append(message_id)
+		changed_triggers = [
+			role_id for role_id in self.role_triggers.keys() | other.role_triggers.keys()
+			if role_id not in self.role_triggers or role_id not in other.role_triggers
+			or not self.role_triggers[role_id].same_as(other.role_triggers[role_id])
+		]
+
+		for message_id in changed_messages:
+			existed = message_id in self.messages
+			if message_id in other.messages:
+				self.messages[message_id] = other.messages[message_id]
+			else:
+				del self.messages[message_id]
+			self.message_changed(message_id, existed)
+		for role_id in changed_triggers:
+			if role_id in other.role_triggers:
+				self.role_triggers[role_id] = other.role_triggers[role_id]
+			else:
+				del self.role_triggers[role_id]
+		self.welcome_channel_id = other.welcome_channel_id
+		self.welcome_role_id = other.welcome_role_id
+		self.send_welcome_on_join = other.send_welcome_on_join
+		self.role_debounce_seconds = other.role_debounce_seconds
+		return changed_messages, changed_triggers
+
+	def import_config(self, other):
+		# replaces this config with other in one go, a single save of what changed and only the changed messages recompiled
+		changed_messages, changed_triggers = self.apply_reload(other)
+		self.save_config(Config_changes(settings=True, messages=changed_messages, role_triggers=changed_triggers))
+		return changed_messages, changed_triggers
+
+	def save_config(self, changes=None):
+		# changes describes what was edited so backends can write only that, None saves everything
+		if changes is None:
+			changes = Config_changes(full=True)
+		if self.writer is not None:
+			self.writer.mark_dirty(self, changes)
+		else:
+			self.storage.write(self.storage.snapshot(self, changes))
+
+	def save_settings(self):
+		self.save_config(Config_changes(settings=True))
 
 	def get_message(self, message_id):
 		return self.messages.get(message_id)
 
 	def set_message(self, message_id, content, buttons=None):
+		old_message = self.messages.get(message_id)
 		if buttons is None:
 			# this is so buttons can be overwritten when the argument is passed
-			buttons = self.messages.get(message_id, {}).get('buttons', [])
-		self.messages[message_id] = {
-			'content': content,
-			'buttons': buttons
-		}
-		self.save_config()
+			buttons = old_message.buttons if old_message else []
+		message = Message(content, buttons)
+		# catch messages that would be too long once placeholders are filled in now instead of at send time
+		content_changed = old_message is None or old_message.content != content
+		if content_changed and message.template.max_length() > MAX_MESSAGE_LENGTH:
+			raise ValueError(f"Message is too long, it can be up to {message.template.max_length()} characters once placeholders are filled in (limit is {MAX_MESSAGE_LENGTH}).")
+		self.messages[message_id] = message
+		self.message_changed(message_id, old_message is not None)
+		self.save_config(Config_changes(messages=[message_id]))
+
+	def delete_message(self, message_id):
+		if message_id not in self.messages:
+			return False
+		del self.messages[message_id]
+		self.message_changed(message_id, True)
+		self.save_config(Config_changes(messages=[message_id]))
+		return True
+
+	def message_changed(self, message_id, existed):
+		# existed tells whether the message was there before the change
+		if self.view_cache is not None:
+			stale = [message_id]
+			if existed != (message_id in self.messages):
+				# buttons linking here get enabled or disabled
+				stale.extend(self.linked_from(message_id))
+			self.view_cache.recompile(self, stale)
+
+	def linked_from(self, message_id):
+		# ids of the messages with a button leading to message_id
+		return [source for source, msg in self.messages.items() if any(btn.target == message_id for btn in msg.buttons)]
+
+	def build_graph(self):
+		# the Message_graph is only needed by a few commands and when a guild becomes available,
+		# so it is built from the messages then instead of being kept with every loaded config
+		return Message_graph(self.messages)
+
+	def entry_points(self):
+		# the messages users start navigating from, the welcome message and the role trigger messages
+		return ['welcome'] + sorted({trigger.message_id for trigger in self.role_triggers.values()} - {'welcome'})
 
 	def set_button(self, message_id, button_label, target_message_id):
 		message = self.get_message(message_id)
 		if message:
-			buttons = message.get('buttons') or []
+			buttons = list(message.buttons)
 			for i, btn in enumerate(buttons):
-				if btn.get('label') == button_label:
-					buttons[i] = {'label': button_label, 'target': target_message_id}
+				if btn.label == button_label:
+					buttons[i] = Button(button_label, target_message_id)
 					break
 			else:
-				buttons.append({'label': button_label, 'target': target_message_id})
-			self.set_message(message_id, message.get('content'), buttons)
-	
+				buttons.append(Button(button_label, target_message_id))
+			self.set_message(message_id, message.content, buttons)
+
 	def set_role_trigger(self, role_id, message_id, priority):
-		self.role_triggers[str(role_id)] = {
-			'message_id': message_id,
-			'priority': priority
-		}
-		self.save_config()
\ No newline at end of file
+		self.role_triggers[int(role_id)] = Role_trigger(message_id, priority)
+		self.save_config(Config_changes(role_triggers=[role_id]))
+
+	def delete_role_trigger(self, role_id):
+		if int(role_id) not in self.role_triggers:
+			return False
+		del self.role_triggers[int(role_id)]
+		self.save_config(Config_changes(role_triggers=[role_id]))
+		return True
+
+	def get_triggered_role(self, added_role_ids):
+		# returns the id of the added role with the highest priority trigger, or None
+		hits = self.role_triggers.keys() & added_role_ids
+		if not hits:
+			return None
+		return max(hits, key=lambda role_id: self.role_triggers[role_id].priority)
+
+
+def is_int(value):
+	# json true and false load as bools, which are ints to isinstance
+	return isinstance(value, int) and not isinstance(value, bool)
+
+
+def config_errors(data):
+	# everything that is wrong with a config dict (e.g. an imported file), checked before any of it is applied
+	if not isinstance(data, dict):
+		return ["The config must be a JSON object."]
+	errors = []
+	messages = data.get('messages', {})
+	if not isinstance(messages, dict):
+		errors.append("'messages' must be an object.")
+		messages = {}
+	for message_id, msg in messages.items():
+		if not isinstance(msg, dict) or not isinstance(msg.get('content', ''), str):
+			errors.append(f"Message '{message_id}' needs a text 'content'.")
+			continue
+		buttons = msg.get('buttons') or []
+		if not isinstance(buttons, list) or not all(
+				isinstance(btn, dict) and isinstance(btn.get('label', 'Next'), str) and isinstance(btn.get('target'), str) for btn in buttons):
+			errors.append(f"Message '{message_id}' has invalid buttons, each one needs a text 'label' and 'target'.")
+		max_length = Template(msg.get('content', '')).max_length()
+		if max_length > MAX_MESSAGE_LENGTH:
+			errors.append(f"Message '{message_id}' is too long, it can be up to {max_length} characters once placeholders are filled in (limit is {MAX_MESSAGE_LENGTH}).")
+	for key in ('welcome_channel_id', 'welcome_role_id'):
+		if not is_int(data.get(key, -1)):
+			errors.append(f"'{key}' must be an integer.")
+	if not isinstance(data.get('send_welcome_on_join', False), bool):
+		errors.append("'send_welcome_on_join' must be true or false.")
+	role_debounce = data.get('role_debounce_seconds', DEFAULT_ROLE_DEBOUNCE)
+	if isinstance(role_debounce, bool) or not isinstance(role_debounce, (int, float)) or not 0 <= role_debounce <= MAX_ROLE_DEBOUNCE:
+		errors.append(f"'role_debounce_seconds' must be a number between 0 and {MAX_ROLE_DEBOUNCE:g}.")
+	role_triggers = data.get('role_triggers', {})
+	if not isinstance(role_triggers, dict):
+		errors.append("'role_triggers' must be an object.")
+		role_triggers = {}
+	for role_id, trigger in role_triggers.items():
+		if not role_id.isdigit():
+			errors.append(f"Role trigger '{role_id}' must be keyed by a role ID.")
+		elif not isinstance(trigger, dict) or not isinstance(trigger.get('message_id'), str) or not is_int(trigger.get('priority')):
+			errors.append(f"Role trigger '{role_id}' needs a text 'message_id' and an integer 'priority'.")
+	return errors
+
+
+def parse_config(raw, server_id):
+	# returns (Server_config, None) for a valid json config, or (None, [errors]); nothing is applied either way
+	try:
+		data = json.loads(raw)
+	except ValueError as e:
+		return None, [f"The file is not valid JSON: {e}"]
+	errors = config_errors(data)
+	if errors:
+		return None, errors
+	config = Server_config()
+	config.from_dict(data)
+	config.server_id = server_id
+	return config, None
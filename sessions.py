@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+
+# per-user navigation sessions for button clicks, keyed by (guild_id, user_id)
+# a session remembers the message the user navigated to last, drops double clicks on the same button
+# and rate limits each user with a small token bucket, so spamming buttons can't make the bot build and send
+# unlimited responses. sessions expire after a while without clicks and the least recently used ones are
+# dropped once max_sessions is reached, a session takes roughly 250 bytes so the defaults stay around 12 MiB
+
+DEFAULT_TTL = 15 * 60
+DEFAULT_MAX_SESSIONS = 50_000
+# a second click on the same button within this many seconds is ignored
+DEFAULT_DOUBLE_CLICK_WINDOW = 1.0
+# clicks per second per user, with bursts of up to DEFAULT_CLICK_BURST
+DEFAULT_CLICK_RATE = 1.0
+DEFAULT_CLICK_BURST = 5
+
+# outcomes of Session_store.click
+ALLOWED = 'allowed'
+DUPLICATE = 'duplicate'
+RATE_LIMITED = 'rate_limited'
+
+
+class Session:
+    __slots__ = ('node', 'last_click', 'tokens', 'refilled', 'seen')
+
+    def __init__(self, tokens, now):
+        # the message id the user navigated to last, a second click leading there is a double click
+        self.node = None
+        self.last_click = 0.0
+        self.tokens = tokens
+        self.refilled = now
+        self.seen = now
+
+
+class Session_store:
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS, double_click_window=DEFAULT_DOUBLE_CLICK_WINDOW,
+                 rate=DEFAULT_CLICK_RATE, burst=DEFAULT_CLICK_BURST):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.double_click_window = double_click_window
+        self.rate = rate
+        self.burst = burst
+        # least recently used first
+        self.sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def click(self, guild_id, user_id, target_message_id, now=None):
+        # records a click on a button leading to target_message_id, returns ALLOWED, DUPLICATE or RATE_LIMITED
+        if now is None:
+            now = time.monotonic()
+        key = (guild_id, user_id)
+        session = self.sessions.get(key)
+        if session is None or now - session.seen > self.ttl:
+            session = self.sessions[key] = Session(self.burst, now)
+            self.evict(now)
+        self.sessions.move_to_end(key)
+        session.seen = now
+
+        if session.node == target_message_id and now - session.last_click < self.double_click_window:
+            return DUPLICATE
+        session.tokens = min(self.burst, session.tokens + (now - session.refilled) * self.rate)
+        session.refilled = now
+        if session.tokens < 1:
+            return RATE_LIMITED
+        session.tokens -= 1
+        session.node = target_message_id
+        session.last_click = now
+        return ALLOWED
+
+    def evict(self, now):
+        # expired sessions are at the front since every click moves its session to the end
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions and now - session.seen <= self.ttl:
+                break
+            del self.sessions[key]
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+
+# storage backends for server configs
+# a backend turns a config (or just the parts of it that changed) into a payload on the event loop thread
+# with snapshot(), and writes that payload from a worker thread with write()
+#
+# Json_storage keeps one pretty-printed file per guild under config/
+# Sqlite_storage keeps every guild in one WAL-mode database with messages, buttons and role triggers as rows
+
+
+class Config_changes:
+    # what changed in a config since it was last saved, full means everything
+    def __init__(self, full=False, settings=False, messages=(), role_triggers=()):
+        self.full = full
+        self.settings = settings
+        self.messages = set(messages)
+        self.role_triggers = set(role_triggers)
+
+    def merge(self, other):
+        self.full = self.full or other.full
+        self.settings = self.settings or other.settings
+        self.messages |= other.messages
+        self.role_triggers |= other.role_triggers
+
+
+def write_json_atomic(path, data):
+    # write to a temp file next to the target and rename it over the original,
+    # so a crash mid-write can never leave a truncated config behind
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Json_storage:
+    # errors write() can raise
+    errors = (OSError,)
+
+    def __init__(self, config_dir='config'):
+        self.config_dir = config_dir
+        # {guild_id: (mtime_ns, size)} of the file versions the bot loaded or wrote itself, so the config watcher
+        # can skip them and the config snapshot knows which file each config matches
+        self.versions = {}
+
+    def path(self, guild_id):
+        return os.path.join(self.config_dir, f'{guild_id}.json')
+
+    def list_guild_ids(self):
+        guild_ids = []
+        with os.scandir(self.config_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    try:
+                        guild_ids.append(int(entry.name[:-5]))
+                    except ValueError:
+                        pass
+        return guild_ids
+
+    def load(self, guild_id):
+        # stat before reading, if the file changes in between the recorded version is the older one
+        path = self.path(guild_id)
+        stat = os.stat(path)
+        with open(path, 'r') as f:
+            config = json.load(f)
+        self.versions[guild_id] = (stat.st_mtime_ns, stat.st_size)
+        return config
+
+    def scan(self):
+        # {guild_id: (mtime_ns, size)} of every config file, used to notice edits made outside the bot
+        files = {}
+        with os.scandir(self.config_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                        files[int(entry.name[:-5])] = (stat.st_mtime_ns, stat.st_size)
+                    except (ValueError, OSError):
+                        pass
+        return files
+
+    def snapshot(self, server_config, changes):
+        # a json file can only be rewritten as a whole
+        return self.path(server_config.server_id), json.dumps(server_config.to_dict(), indent=4)
+
+    def write(self, payload):
+        path, data = payload
+        write_json_atomic(path, data)
+        stat = os.stat(path)
+        self.versions[int(os.path.basename(path)[:-5])] = (stat.st_mtime_ns, stat.st_size)
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS guilds (
+    server_id INTEGER PRIMARY KEY,
+    welcome_channel_id INTEGER NOT NULL,
+    welcome_role_id INTEGER NOT NULL,
+    send_welcome_on_join INTEGER NOT NULL,
+    role_debounce_seconds REAL NOT NULL DEFAULT 0.5
+);
+CREATE TABLE IF NOT EXISTS messages (
+    server_id INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (server_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS buttons (
+    server_id INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    target TEXT NOT NULL,
+    PRIMARY KEY (server_id, message_id, position)
+);
+CREATE TABLE IF NOT EXISTS role_triggers (
+    server_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    PRIMARY KEY (server_id, role_id)
+);
+'''
+
+
+class Sqlite_storage:
+    def __init__(self, path):
+        # imported here since most bots run on json files
+        import sqlite3
+        self.errors = (OSError, sqlite3.Error)
+        self.path = path
+        # loads run in the preload thread pool and writes in the writer thread, so the connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SQLITE_SCHEMA)
+        # databases created before role debouncing existed
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(guilds)')}
+        if 'role_debounce_seconds' not in columns:
+            self.connection.execute('ALTER TABLE guilds ADD COLUMN role_debounce_seconds REAL NOT NULL DEFAULT 0.5')
+
+    def list_guild_ids(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT server_id FROM guilds')]
+
+    def load(self, guild_id):
+        with self.lock:
+            guild = self.connection.execute(
+                'SELECT welcome_channel_id, welcome_role_id, send_welcome_on_join, role_debounce_seconds FROM guilds WHERE server_id = ?',
+                (guild_id,)
+            ).fetchone()
+            if guild is None:
+                raise FileNotFoundError(f'no config stored for guild {guild_id}')
+            messages = {}
+            for message_id, content in self.connection.execute(
+                    'SELECT message_id, content FROM messages WHERE server_id = ?', (guild_id,)):
+                messages[message_id] = {'content': content, 'buttons': []}
+            for message_id, label, target in self.connection.execute(
+                    'SELECT message_id, label, target FROM buttons WHERE server_id = ? ORDER BY message_id, position',
+                    (guild_id,)):
+                if message_id in messages:
+                    messages[message_id]['buttons'].append({'label': label, 'target': target})
+            role_triggers = {}
+            for role_id, message_id, priority in self.connection.execute(
+                    'SELECT role_id, message_id, priority FROM role_triggers WHERE server_id = ?', (guild_id,)):
+                role_triggers[str(role_id)] = {'message_id': message_id, 'priority': priority}
+        return {
+            'messages': messages,
+            'welcome_channel_id': guild[0],
+            'server_id': guild_id,
+            'welcome_role_id': guild[1],
+            'send_welcome_on_join': bool(guild[2]),
+            'role_debounce_seconds': guild[3],
+            'role_triggers': role_triggers
+        }
+
+    def snapshot(self, server_config, changes):
+        # copy only the changed rows, a message or trigger that no longer exists is recorded as None
+        message_ids = server_config.messages.keys() if changes.full else changes.messages
+        role_ids = server_config.role_triggers.keys() if changes.full else changes.role_triggers
+        messages = {}
+        for message_id in message_ids:
+            msg = server_config.messages.get(message_id)
+            if msg is not None:
+                msg = (msg.content, [(btn.label, btn.target) for btn in msg.buttons])
+            messages[message_id] = msg
+        role_triggers = {}
+        for role_id in role_ids:
+            trigger = server_config.role_triggers.get(int(role_id))
+            if trigger is not None:
+                trigger = (trigger.message_id, trigger.priority)
+            role_triggers[int(role_id)] = trigger
+        settings = (
+            server_config.server_id,
+            server_config.welcome_channel_id,
+            server_config.welcome_role_id,
+            int(server_config.send_welcome_on_join),
+            server_config.role_debounce_seconds,
+        )
+        return settings, changes.full, messages, role_triggers
+
+    def write(self, payload):
+        settings, full, messages, role_triggers = payload
+        server_id = settings[0]
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO guilds (server_id, welcome_channel_id, welcome_role_id, send_welcome_on_join, role_debounce_seconds) '
+                'VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (server_id) DO UPDATE SET welcome_channel_id = excluded.welcome_channel_id, '
+                'welcome_role_id = excluded.welcome_role_id, send_welcome_on_join = excluded.send_welcome_on_join, '
+                'role_debounce_seconds = excluded.role_debounce_seconds',
+                settings
+            )
+            if full:
+                for table in ('messages', 'buttons', 'role_triggers'):
+                    self.connection.execute(f'DELETE FROM {table} WHERE server_id = ?', (server_id,))
+            for message_id, msg in messages.items():
+                self.connection.execute('DELETE FROM buttons WHERE server_id = ? AND message_id = ?', (server_id, message_id))
+                if msg is None:
+                    self.connection.execute('DELETE FROM messages WHERE server_id = ? AND message_id = ?', (server_id, message_id))
+                    continue
+                content, buttons = msg
+                self.connection.execute(
+                    'INSERT INTO messages (server_id, message_id, content) VALUES (?, ?, ?) '
+                    'ON CONFLICT (server_id, message_id) DO UPDATE SET content = excluded.content',
+                    (server_id, message_id, content)
+                )
+                self.connection.executemany(
+                    'INSERT INTO buttons (server_id, message_id, position, label, target) VALUES (?, ?, ?, ?, ?)',
+                    [(server_id, message_id, position, label, target) for position, (label, target) in enumerate(buttons)]
+                )
+            for role_id, trigger in role_triggers.items():
+                if trigger is None:
+                    self.connection.execute('DELETE FROM role_triggers WHERE server_id = ? AND role_id = ?', (server_id, role_id))
+                else:
+                    self.connection.execute(
+                        'INSERT INTO role_triggers (server_id, role_id, message_id, priority) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT (server_id, role_id) DO UPDATE SET message_id = excluded.message_id, priority = excluded.priority',
+                        (server_id, role_id, trigger[0], trigger[1])
+                    )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,69 @@
+import re
+
+# message templates are parsed once into literal and placeholder segments when a message is set or loaded,
+# rendering then only fills in the placeholder slots and joins, no matter how long the text is
+
+MAX_MESSAGE_LENGTH = 2000
+
+# the longest text each placeholder can render to (for a single user), used to check messages when they are set
+PLACEHOLDER_MAX_LENGTH = {
+    'user': len('<@18446744073709551615>'),
+    'server': 100,
+    'member_count': 7,
+    'role': len('<@&18446744073709551615>'),
+}
+
+PLACEHOLDER_PATTERN = re.compile('<(' + '|'.join(PLACEHOLDER_MAX_LENGTH) + ')>')
+# one shared string per placeholder, so templates don't each hold their own copies of '<user>' and its name
+PLACEHOLDER_TEXT = {name: f'<{name}>' for name in PLACEHOLDER_MAX_LENGTH}
+PLACEHOLDER_NAMES = {name: name for name in PLACEHOLDER_MAX_LENGTH}
+
+
+class Template:
+    __slots__ = ('segments', 'slots')
+
+    def __init__(self, content):
+        # re.split with a capturing group alternates literal text and placeholder names
+        parts = PLACEHOLDER_PATTERN.split(content)
+        if len(parts) == 1:
+            # most messages have no placeholders, their segments are just the content string itself
+            self.segments = content
+            self.slots = ()
+            return
+        self.segments = tuple(PLACEHOLDER_TEXT[part] if i % 2 else part for i, part in enumerate(parts))
+        self.slots = tuple((i, PLACEHOLDER_NAMES[parts[i]]) for i in range(1, len(parts), 2))
+
+    @classmethod
+    def restore(cls, segments, slots):
+        # an already parsed template, e.g. from the config snapshot
+        template = cls.__new__(cls)
+        template.segments = segments
+        template.slots = slots
+        return template
+
+    def source(self):
+        # the content the template was parsed from
+        if not self.slots:
+            return self.segments
+        return ''.join(self.segments)
+
+    @property
+    def placeholders(self):
+        return {name for _, name in self.slots}
+
+    def max_length(self):
+        if not self.slots:
+            return len(self.segments)
+        literal_length = sum(len(self.segments[i]) for i in range(0, len(self.segments), 2))
+        return literal_length + sum(PLACEHOLDER_MAX_LENGTH[name] for _, name in self.slots)
+
+    def render(self, values):
+        # placeholders without a value are left as they are
+        if not self.slots:
+            return self.segments
+        segments = list(self.segments)
+        for i, name in self.slots:
+            value = values.get(name)
+            if value is not None:
+                segments[i] = value
+        return ''.join(segments)
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config_registry import Config_registry
+from config_watcher import Config_watcher
+from persistence import Config_writer
+from server_config import Server_config
+from storage import Json_storage
+
+# run with: python -m unittest discover tests
+
+GUILD_ID = 10**17
+
+
+def write_config(config_dir, messages):
+    with open(os.path.join(config_dir, f'{GUILD_ID}.json'), 'w') as f:
+        json.dump({'messages': {message_id: {'content': content} for message_id, content in messages.items()},
+                   'server_id': GUILD_ID}, f)
+
+
+class Config_watcher_test(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.storage = Json_storage(self.config_dir.name)
+        self.writer = Config_writer()
+        self.saved = (Server_config.storage, Server_config.writer, Server_config.view_cache)
+        Server_config.storage, Server_config.writer, Server_config.view_cache = self.storage, self.writer, None
+        write_config(self.config_dir.name, {'welcome': 'hello'})
+        self.registry = Config_registry(storage=self.storage, writer=self.writer)
+        self.watcher = Config_watcher(self.registry)
+
+    def tearDown(self):
+        Server_config.storage, Server_config.writer, Server_config.view_cache = self.saved
+        self.config_dir.cleanup()
+
+    async def test_edit_during_reload_is_kept(self):
+        config = self.registry.get(GUILD_ID)
+        self.watcher.files = self.storage.scan()
+        # the file is edited by hand, then an admin edits the guild while the watcher is still reading that file
+        write_config(self.config_dir.name, {'welcome': 'edited by hand'})
+        os.utime(self.storage.path(GUILD_ID), ns=(1, 1))
+        loading = threading.Event()
+        release = threading.Event()
+        load = self.registry.load
+
+        def slow_load(guild_id):
+            loading.set()
+            release.wait(5)
+            return load(guild_id)
+
+        self.registry.load = slow_load
+        check = asyncio.create_task(self.watcher.check())
+        await asyncio.to_thread(loading.wait, 5)
+        config.set_message('admin', 'added by an admin')
+        release.set()
+        await check
+
+        self.assertEqual(config.get_message('admin').content, 'added by an admin')
+        await self.writer.flush()
+        with open(self.storage.path(GUILD_ID)) as f:
+            self.assertIn('admin', json.load(f)['messages'])
+
+    async def test_reload_without_edits_is_applied(self):
+        config = self.registry.get(GUILD_ID)
+        self.watcher.files = self.storage.scan()
+        write_config(self.config_dir.name, {'welcome': 'edited by hand'})
+        os.utime(self.storage.path(GUILD_ID), ns=(1, 1))
+        await self.watcher.check()
+        self.assertEqual(config.get_message('welcome').content, 'edited by hand')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import discord
+
+# compiled button responses, the message and its buttons per guild and message id
+# every button gets a stable custom_id that encodes the guild and the target message, clicks are routed by one
+# DynamicItem registered with the client that matches those ids, so they keep working across restarts without
+# any view being kept around. every send gets its own view built from the compiled buttons, and that view is
+# stopped before it is sent so discord.py neither stores it nor changes its timeout.
+# clicks are answered straight from this cache, without going through the config registry.
+# whenever a message changes its response is compiled again right away, so clicks don't miss the cache.
+# a guild's responses are dropped together with its config when the config registry evicts it, and compiled
+# again on demand the next time the config is loaded
+
+CUSTOM_ID_PREFIX = 'cbm'
+# discord rejects custom ids longer than this
+CUSTOM_ID_MAX_LENGTH = 100
+CUSTOM_ID_TEMPLATE = CUSTOM_ID_PREFIX + r':(?P<guild_id>[0-9]+):(?P<index>[0-9]+):(?P<target>.+)'
+
+
+def make_custom_id(guild_id, index, target_message_id):
+    # the button index keeps ids unique when two buttons link to the same message
+    return f'{CUSTOM_ID_PREFIX}:{guild_id}:{index}:{target_message_id}'
+
+
+def parse_custom_id(custom_id):
+    # returns (guild_id, target_message_id), or None if the id wasn't made by make_custom_id
+    parts = custom_id.split(':', 3)
+    if len(parts) != 4 or parts[0] != CUSTOM_ID_PREFIX:
+        return None
+    try:
+        return int(parts[1]), parts[3]
+    except ValueError:
+        return None
+
+
+class Route_button(discord.ui.DynamicItem[discord.ui.Button], template=CUSTOM_ID_TEMPLATE):
+    # set by View_cache, dispatch(interaction, guild_id, target_message_id)
+    dispatch = None
+
+    def __init__(self, label, custom_id, disabled=False):
+        super().__init__(discord.ui.Button(label=label, style=discord.ButtonStyle.primary, custom_id=custom_id, disabled=disabled))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(item.label, item.custom_id, item.disabled)
+
+    async def callback(self, interaction: discord.Interaction):
+        route = parse_custom_id(self.custom_id)
+        if route is not None and self.dispatch is not None:
+            await self.dispatch(interaction, *route)
+
+
+class View_cache:
+    def __init__(self, client: discord.Client, dispatch):
+        # dispatch(interaction, guild_id, target_message_id) handles every button click
+        self.client = client
+        Route_button.dispatch = staticmethod(dispatch)
+        client.add_dynamic_items(Route_button)
+        # {guild_id: {message_id: (Message, ((label, custom_id, disabled), ...))}}
+        self.responses = {}
+
+    def __len__(self):
+        return sum(len(responses) for responses in self.responses.values())
+
+    def compile_buttons(self, guild_id, buttons, messages=None):
+        compiled = []
+        for index, button in enumerate(buttons):
+            custom_id = make_custom_id(guild_id, index, button.target)
+            if len(custom_id) > CUSTOM_ID_MAX_LENGTH:
+                print(f"skipping button '{button.label}' in guild {guild_id}, target id is too long")
+                continue
+            # buttons whose target message was deleted are shown disabled instead of leading nowhere
+            disabled = messages is not None and button.target not in messages
+            compiled.append((button.label, custom_id, disabled))
+        return tuple(compiled)
+
+    def make_view(self, compiled):
+        # a new view for every send, clicks are routed by the registered Route_button and not by this view
+        if not compiled:
+            return None
+        view = discord.ui.View(timeout=None)
+        for label, custom_id, disabled in compiled:
+            view.add_item(Route_button(label, custom_id, disabled))
+        view.stop()
+        return view
+
+    def get(self, guild_id, message_id, msg, messages=None):
+        # returns a view for sending a message, or None if it has no buttons
+        responses = self.responses.setdefault(guild_id, {})
+        cached = responses.get(message_id)
+        if cached is None or cached[0] is not msg:
+            cached = responses[message_id] = (msg, self.compile_buttons(guild_id, msg.buttons, messages))
+        return self.make_view(cached[1])
+
+    def lookup(self, guild_id, message_id):
+        # returns (Message, View or None) if the response is compiled already, otherwise None
+        cached = self.responses.get(guild_id, {}).get(message_id)
+        if cached is None:
+            return None
+        return cached[0], self.make_view(cached[1])
+
+    def invalidate(self, guild_id, message_id):
+        responses = self.responses.get(guild_id)
+        if responses is not None:
+            responses.pop(message_id, None)
+            if not responses:
+                del self.responses[guild_id]
+
+    def forget_guild(self, guild_id):
+        # the guild's config left memory, its responses would otherwise keep its messages alive
+        self.responses.pop(guild_id, None)
+
+    def compile(self, server_config, message_ids):
+        responses = None
+        for message_id in message_ids:
+            msg = server_config.messages.get(message_id)
+            if msg is not None:
+                if responses is None:
+                    responses = self.responses.setdefault(server_config.server_id, {})
+                responses[message_id] = (msg, self.compile_buttons(server_config.server_id, msg.buttons, server_config.messages))
+
+    def recompile(self, server_config, message_ids):
+        for message_id in message_ids:
+            self.invalidate(server_config.server_id, message_id)
+        self.compile(server_config, message_ids)
+
+    def register_guild(self, server_config):
+        # called when a guild becomes available,
+        # everything reachable from the entry points is compiled first, then the messages nothing links to
+        entry_points = server_config.entry_points()
+        graph = server_config.build_graph()
+        self.compile(server_config, graph.walk(entry_points))
+        self.compile(server_config, graph.unreachable(entry_points))